@@ -0,0 +1,304 @@
+"""
+Reading the student archives nested in the Canvas ZIP file.
+
+`zipfile` seeks around a nested ZIP file to read its central directory, and every backward seek in a compressed
+member decompresses it again from the start. Members of the Canvas ZIP file are therefore read only once: stored
+members are read in place from a memory map of the Canvas ZIP file, and compressed members are inflated once into a
+buffer that spills to a temporary file past `SPOOL_LIMIT`. Compressed tarballs are inflated the same way before they
+are read.
+
+Student archives can be ZIP files, tarballs, or 7z archives if `py7zr` is installed. Only members named like an
+archive are read as one, as documents such as .docx or .pptx files are ZIP files too. The format itself is found from
+the content, not the file name.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import mmap
+import os
+import re
+import shutil
+import struct
+import tarfile
+import tempfile
+import zipfile
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import BinaryIO
+
+SPOOL_LIMIT = 16 * 2**20
+CHUNK = 2**20
+
+# Magic numbers of the compressed streams a tarball may be wrapped in
+COMPRESSED = {
+    b"\x1f\x8b": gzip.open,
+    b"BZh": bz2.open,
+    b"\xfd7zXZ\x00": lzma.open,
+}
+SEVEN_ZIP = b"7z\xbc\xaf\x27\x1c"
+# Extensions of the archive formats above
+ARCHIVE_NAME = re.compile(r"\.(zip|7z|tgz|tbz2?|txz|tar(\.(gz|bz2|xz))?)$", re.IGNORECASE)
+
+# Local file header of a ZIP member, which precedes its data: signature, ..., file name length, extra field length
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+
+
+class UnsupportedArchive(Exception):
+    pass
+
+
+class MemoryReader(io.RawIOBase):
+    """Seekable, read-only file over a buffer, such as part of a memory map, without copying it."""
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = min(len(b), len(self.view) - self.pos)
+        if n <= 0:
+            return 0
+        b[:n] = self.view[self.pos : self.pos + n]
+        self.pos += n
+        return n
+
+    def seek(self, offset: int, whence=io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def close(self) -> None:
+        if not self.closed:
+            self.view.release()
+        super().close()
+
+
+def spool(stream: BinaryIO, limit=SPOOL_LIMIT) -> BinaryIO:
+    """Read the stream once into a buffer, which spills to a temporary file past `limit` bytes."""
+    buffer = tempfile.SpooledTemporaryFile(max_size=limit)
+    shutil.copyfileobj(stream, buffer, CHUNK)
+    buffer.seek(0)
+    return buffer
+
+
+@dataclass
+class ArchiveMember:
+    """A file or folder in a student archive. Folder names end with a slash, like in ZIP files."""
+
+    name: str
+    size: int
+    info: object = None
+
+    @property
+    def is_dir(self) -> bool:
+        return self.name.endswith("/")
+
+
+class StudentArchive(ABC):
+    """A student archive read from a seekable file. Use `open_archive` to open one in any supported format."""
+
+    def __init__(self, fp: BinaryIO):
+        self.fp = fp
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @abstractmethod
+    def members(self) -> list[ArchiveMember]:
+        """Every member of the archive, with the names of folders ending in a slash."""
+
+    def namelist(self) -> list[str]:
+        return [m.name for m in self.members()]
+
+    @abstractmethod
+    def read(self, members: list[ArchiveMember]) -> Iterator[tuple[ArchiveMember, BinaryIO]]:
+        """Open each of the members for reading, in archive order."""
+
+    def close(self) -> None:
+        self.fp.close()
+
+
+class ZipArchive(StudentArchive):
+    def __init__(self, fp: BinaryIO):
+        super().__init__(fp)
+        self.zf = zipfile.ZipFile(fp)
+
+    def members(self) -> list[ArchiveMember]:
+        return [ArchiveMember(info.filename, info.file_size, info) for info in self.zf.infolist()]
+
+    def read(self, members):
+        for member in members:
+            with self.zf.open(member.info) as f:
+                yield member, f
+
+    def close(self) -> None:
+        self.zf.close()
+        super().close()
+
+
+class TarArchive(StudentArchive):
+    def __init__(self, fp: BinaryIO):
+        super().__init__(fp)
+        self.tf = tarfile.open(fileobj=fp, mode="r:")
+
+    def members(self) -> list[ArchiveMember]:
+        # Links and special files are left out, as they are never part of a submission
+        return [
+            ArchiveMember(info.name + "/" if info.isdir() else info.name, info.size, info)
+            for info in self.tf.getmembers()
+            if info.isdir() or info.isfile()
+        ]
+
+    def read(self, members):
+        for member in members:
+            with self.tf.extractfile(member.info) as f:
+                yield member, f
+
+    def close(self) -> None:
+        self.tf.close()
+        super().close()
+
+
+class SevenZipArchive(StudentArchive):
+    def __init__(self, fp: BinaryIO):
+        super().__init__(fp)
+        # py7zr loads a stack of compression modules, so it waits for the first 7z upload
+        try:
+            import py7zr
+        except ImportError:  # Optional, only needed for 7z uploads
+            raise UnsupportedArchive("7z archives need the py7zr package") from None
+        self.sz = py7zr.SevenZipFile(fp)
+
+    def members(self) -> list[ArchiveMember]:
+        return [
+            ArchiveMember(info.filename + "/" if info.is_directory else info.filename, info.uncompressed, info)
+            for info in self.sz.list()
+        ]
+
+    def read(self, members):
+        # 7z archives are usually solid, so the members are decompressed together in a single pass
+        with tempfile.TemporaryDirectory() as tmp:
+            self.sz.reset()
+            self.sz.extract(path=tmp, targets=[m.name for m in members if not m.is_dir])
+            for member in members:
+                path = os.path.join(tmp, safe_name(member.name))
+                if os.path.isfile(path):
+                    with open(path, "rb") as f:
+                        yield member, f
+
+    def close(self) -> None:
+        self.sz.close()
+        super().close()
+
+
+def is_archive(name: str, head: bytes) -> bool:
+    """Whether a file is named like an archive, and its first bytes are those of a format `open_archive` reads."""
+    if not ARCHIVE_NAME.search(name):
+        return False
+    return head.startswith((b"PK\x03\x04", b"PK\x05\x06", SEVEN_ZIP, *COMPRESSED)) or head[257:262] == b"ustar"
+
+
+def open_archive(fp: BinaryIO) -> StudentArchive:
+    """Open a student archive from a seekable file, finding its format from its first bytes."""
+    head = fp.read(262)
+    fp.seek(0)
+    if head.startswith(SEVEN_ZIP):
+        return SevenZipArchive(fp)
+    for magic, decompressor in COMPRESSED.items():
+        if head.startswith(magic):
+            # Inflated once, so tarfile can seek without decompressing again
+            with decompressor(fp, "rb") as stream:
+                plain = spool(stream)
+            fp.close()
+            try:
+                return TarArchive(plain)
+            except Exception:
+                plain.close()
+                raise
+    if head[257:262] == b"ustar":
+        return TarArchive(fp)
+    return ZipArchive(fp)
+
+
+def safe_name(name: str) -> str:
+    """Relative path to extract a member to, without absolute paths or parent folders, like `zipfile` does."""
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    if parts and parts[0].endswith(":"):
+        parts = parts[1:]
+    return os.path.join(*parts) if parts else ""
+
+
+class CanvasZip:
+    """
+    The Canvas ZIP file, opened once to read the student archives nested in it.
+
+    :param canvas_zip: Path to the Canvas ZIP file, or a file object.
+    """
+
+    def __init__(self, canvas_zip):
+        self.zf = zipfile.ZipFile(canvas_zip, "r")
+        self.map = None
+        try:
+            fileno = self.zf.fp.fileno()
+        except (AttributeError, OSError):
+            fileno = None
+        if fileno is not None and os.fstat(fileno).st_size:
+            self.map = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self) -> "CanvasZip":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def infolist(self) -> list[zipfile.ZipInfo]:
+        return self.zf.infolist()
+
+    def getinfo(self, name: str) -> zipfile.ZipInfo:
+        return self.zf.getinfo(name)
+
+    def open_member(self, info: zipfile.ZipInfo) -> BinaryIO:
+        """Seekable copy of a member, read in place if it is stored uncompressed."""
+        if self.map is not None and info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+            fields = LOCAL_HEADER.unpack_from(self.map, info.header_offset)
+            if fields[0] == b"PK\x03\x04":
+                start = info.header_offset + LOCAL_HEADER.size + fields[10] + fields[11]
+                return io.BufferedReader(MemoryReader(memoryview(self.map)[start : start + info.file_size]))
+        with self.zf.open(info) as f:
+            return spool(f)
+
+    def is_archive(self, info: zipfile.ZipInfo) -> bool:
+        """Whether the member is a student archive, rather than a file uploaded next to it, like a report."""
+        with self.zf.open(info) as f:
+            return is_archive(info.filename, f.read(262))
+
+    def open_archive(self, info: zipfile.ZipInfo) -> StudentArchive:
+        fp = self.open_member(info)
+        try:
+            return open_archive(fp)
+        except Exception:
+            fp.close()
+            raise
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+        self.zf.close()
@@ -0,0 +1,351 @@
+"""
+Generate a synthetic Canvas export and time each stage of the pipeline against it.
+
+Results are written as JSON, so runs can be compared across commits:
+
+    python benchmark.py -n 300 --files 8 --depth 2 -o bench.json
+
+The startup time of the command line entry points is measured with `-X importtime`. Fail if it regresses, such as
+when a heavy dependency is imported at startup again:
+
+    python benchmark.py --startup-only --max-startup 80
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import mos_moss
+import zipfile_check
+from moss_server import MossServer
+
+TEMPLATE = "starters/csc340/Assignment-04-Code"
+
+ENTRY_POINTS = ["mos_moss", "zipfile_check", "driver"]
+# Only imported by the stages that use them, never when an entry point starts
+LAZY_IMPORTS = {"mosspy", "requests", "seedir", "dotenv", "sqlite3", "py7zr"}
+
+
+def student_files(template: list[tuple[str, str]], files: int, rng: random.Random) -> list[tuple[str, str]]:
+    """Pick `files` files from the template, each with some student-specific code added."""
+    lines = [line for _, content in template for line in content.splitlines() if line.strip()]
+    result = []
+    for i in range(files):
+        name, content = template[i % len(template)]
+        if i >= len(template):
+            stem, ext = os.path.splitext(name)
+            name = f"{stem}{i // len(template)}{ext}"
+        extra = rng.sample(lines, k=min(len(lines), rng.randint(0, 60)))
+        result.append((name, content + "\n" + "\n".join(extra) + "\n"))
+    return result
+
+
+def student_zip(name: str, files: list[tuple[str, str]], depth: int, parts: int, junk: bool) -> bytes:
+    """Build a student's ZIP file, nesting the files `depth` folders deep and spreading them over the parts."""
+    root = "/".join([f"{name}-Assignment-04"] + [f"level{i}" for i in range(1, depth)])
+    b = io.BytesIO()
+    with zipfile.ZipFile(b, "w", zipfile.ZIP_DEFLATED) as zf:
+        for i, (filename, content) in enumerate(files):
+            path = f"{root}/Part_{chr(ord('A') + i % parts)}/{filename}"
+            zf.writestr(path, content)
+            if junk:
+                zf.writestr(f"__MACOSX/{os.path.dirname(path)}/._{filename}", b"\0" * 256)
+        zf.writestr(f"{root}/{name}-Assignment-04-Report.pdf", b"%PDF-1.4\n" + bytes(range(256)) * 8)
+    return b.getvalue()
+
+
+def generate(
+    path: str,
+    template=TEMPLATE,
+    students=100,
+    files=8,
+    depth=1,
+    parts=2,
+    resubmissions=0.1,
+    junk=True,
+    seed=0,
+) -> None:
+    """
+    Generate a Canvas export at `path`.
+
+    :param template: Folder with the starter files each student's submission is based on.
+    :param students: Number of students.
+    :param files: Number of source files per student.
+    :param depth: Number of folders the files are nested in.
+    :param parts: Number of "Part_X" folders the files are spread over.
+    :param resubmissions: Fraction of students with a resubmission, named with a "-1" suffix.
+    :param junk: Whether to add __MACOSX folders.
+    :param seed: Seed for the random student edits.
+    """
+    rng = random.Random(seed)
+    template_files = []
+    for f in sorted(Path(template).iterdir()):
+        if f.is_file():
+            template_files.append((f.name, f.read_text(encoding="utf-8", errors="replace")))
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as zf:
+        for i in range(students):
+            name = f"Student{i}"
+            prefix = f"student{i}last_{100000 + i}_{900000000 + i}_{name}-Assignment-04"
+            attempts = 2 if rng.random() < resubmissions else 1
+            for attempt in range(attempts):
+                suffix = f"-{attempt}" if attempt else ""
+                data = student_zip(name, student_files(template_files, files, rng), depth, parts, junk)
+                zf.writestr(f"{prefix}{suffix}.zip", data)
+
+
+def timed(timings: dict[str, float], stage: str, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings[stage] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def send(server: MossServer, zip_output: str, report_path: str, language: str, max_submissions: int, concurrency=1):
+    """Stage every batch needed to compare all pairs of submissions, and send them to the stand-in server."""
+    index = mos_moss.FileIndex.build(zip_output)
+    folders = index.submission_folders(zip_output)
+    batches = mos_moss.plan_batches(folders, max_submissions) if max_submissions else [None]
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        for n, batch in enumerate(batches, start=1):
+            moss = mos_moss.stage_moss_files(
+                zip_output, language, max_submissions, None, None, index=index, submission_folders=batch
+            )
+            moss.server, moss.port = server.host, server.port
+            futures.append(
+                executor.submit(
+                    mos_moss.send_to_moss,
+                    moss,
+                    report_path,
+                    user_id=1,
+                    count=n,
+                    attempts=3 if server.failure_rate else 1,
+                )
+            )
+        for future in futures:
+            future.result()
+
+
+def run(
+    canvas_zip: str,
+    work_dir: str,
+    language="cpp",
+    parts=2,
+    max_submissions=0,
+    jobs=1,
+    server: MossServer = None,
+    concurrency=1,
+) -> dict[str, float]:
+    """
+    Time each stage of both pipelines against the Canvas export.
+    If a stand-in MOSS `server` is given, the submit path is timed against it too.
+    """
+    timings = {}
+    zip_output = os.path.join(work_dir, "zip_output")
+    parts = [chr(ord("A") + i) for i in range(parts)]
+
+    timed(timings, "unzip_canvas_submission", mos_moss.unzip_canvas_submission, canvas_zip, zip_output, jobs=jobs)
+    timed(timings, "list_files", mos_moss.list_files, zip_output, language)
+    timed(timings, "stage_moss_files", mos_moss.stage_moss_files, zip_output, language, max_submissions)
+    if server:
+        report_path = os.path.join(work_dir, "report")
+        timed(timings, "send_to_moss", send, server, zip_output, report_path, language, max_submissions, concurrency)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        submissions = timed(timings, "check_zipfile", zipfile_check.check_zipfile, canvas_zip, parts, tree=True)
+        timed(timings, "display_submissions", zipfile_check.display_submissions, submissions, verbose=True)
+
+    for stage, seconds in timings.items():
+        print(f"{stage}: {seconds:.3f}s")
+    return timings
+
+
+def import_times(module: str) -> dict[str, tuple[int, int]]:
+    """
+    Time to import each module loaded by `import module`, from `-X importtime`. Returns the nesting depth of each,
+    with 0 for the entry point itself, and the cumulative time in microseconds.
+    """
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = (depth, int(cumulative))
+        # Modules are listed after their imports, so a finished top-level import other than the entry point,
+        # such as site, ends a tree that is not part of the entry point's startup
+        if depth == 0 and name.strip() != module:
+            times = {}
+    return times
+
+
+def startup(modules=ENTRY_POINTS, repeat=5) -> dict[str, dict]:
+    """
+    Time importing each entry point, keeping the fastest of `repeat` runs, and list the lazy imports it loaded.
+    The first run also writes the bytecode cache, so it does not count towards the time.
+    """
+    results = {}
+    for module in modules:
+        runs = [import_times(module) for _ in range(repeat + 1)][1:]
+        best = min(runs, key=lambda times: times[module][1])
+        slowest = sorted((t, name) for name, (depth, t) in best.items() if depth == 1)[-5:]
+        results[module] = {
+            "import_ms": round(best[module][1] / 1000, 1),
+            "eager": sorted(LAZY_IMPORTS & set(best)),
+            "slowest": {name: round(t / 1000, 1) for t, name in reversed(slowest)},
+        }
+        print(f"import {module}: {results[module]['import_ms']:.1f}ms")
+    return results
+
+
+def commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against a synthetic Canvas export.")
+
+    parser.add_argument("-n", "--students", metavar="n", help="Number of students.", type=int, default=100)
+    parser.add_argument("--files", metavar="n", help="Number of source files per student.", type=int, default=8)
+    parser.add_argument("--depth", metavar="n", help="Number of folders files are nested in.", type=int, default=1)
+    parser.add_argument("--parts", metavar="n", help="Number of Part_X folders per student.", type=int, default=2)
+    parser.add_argument(
+        "--resubmissions",
+        metavar="fraction",
+        help="Fraction of students with a resubmission.",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument("--no-junk", help="Do not add __MACOSX folders.", action="store_true")
+    parser.add_argument("--template", metavar="path", help="Folder of starter files.", default=TEMPLATE)
+    parser.add_argument("--seed", metavar="n", help="Seed for generating submissions.", type=int, default=0)
+    parser.add_argument("-j", "--jobs", metavar="n", help="Worker processes for extraction.", type=int, default=1)
+    parser.add_argument(
+        "--max-submissions", metavar="n", help="Maximum number of submissions per batch.", type=int, default=0
+    )
+    parser.add_argument(
+        "--send", help="Also time sending the batches to a local stand-in MOSS server.", action="store_true"
+    )
+    parser.add_argument(
+        "-c", "--concurrency", metavar="n", help="Number of batches in flight when sending.", type=int, default=1
+    )
+    parser.add_argument(
+        "--latency", metavar="seconds", help="Time the stand-in server takes per query.", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--failure-rate",
+        metavar="fraction",
+        help="Chance of the stand-in server failing a query or report page.",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--startup-only",
+        help="Only time the startup of the entry points, without a Canvas export.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-startup",
+        metavar="ms",
+        help="Exit with an error if an entry point takes longer than this to import, or imports a lazy dependency.",
+        type=float,
+    )
+    parser.add_argument("-o", "--output", metavar="path", help="Path to write results as JSON.")
+
+    return parser.parse_args()
+
+
+def main():
+    opt = parse_args()
+    results = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(opt).items() if k != "output"},
+        "startup": startup(),
+    }
+    if not opt.startup_only:
+        results.update(pipeline(opt))
+
+    if opt.output:
+        with open(opt.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if opt.max_startup is not None:
+        for module, r in results["startup"].items():
+            if r["eager"]:
+                sys.exit(f"{module} imports {', '.join(r['eager'])} at startup")
+            if r["import_ms"] > opt.max_startup:
+                sys.exit(f"{module} takes {r['import_ms']}ms to import, over {opt.max_startup}ms")
+
+
+def pipeline(opt: argparse.Namespace) -> dict:
+    """Generate a Canvas export from the options and time the pipeline against it."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        canvas_zip = os.path.join(work_dir, "submissions.zip")
+        start = time.perf_counter()
+        generate(
+            canvas_zip,
+            template=opt.template,
+            students=opt.students,
+            files=opt.files,
+            depth=opt.depth,
+            parts=opt.parts,
+            resubmissions=opt.resubmissions,
+            junk=not opt.no_junk,
+            seed=opt.seed,
+        )
+        print(f"Generated {os.path.getsize(canvas_zip) / 2**20:.1f} MiB in {time.perf_counter() - start:.1f}s")
+
+        with contextlib.ExitStack() as stack:
+            server = None
+            if opt.send:
+                server = stack.enter_context(
+                    MossServer(latency=opt.latency, failure_rate=opt.failure_rate, seed=opt.seed)
+                )
+            timings = run(
+                canvas_zip,
+                work_dir,
+                parts=opt.parts,
+                max_submissions=opt.max_submissions,
+                jobs=opt.jobs,
+                server=server,
+                concurrency=opt.concurrency,
+            )
+
+    results = {"timings": timings}
+    if server:
+        results["server"] = server.stats
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Helpers for the ZIP file Canvas generates when downloading all submissions of an assignment."""
+
+import os
+import re
+import zipfile
+
+# Canvas ZIP name format (may contain -i at the end for resubmissions, where i is the attempt number):
+# <last><first>[_LATE]_<canvas_id>_<sis_id>_<original_filename>[-i]
+CANVAS_NAME = re.compile(r"([^\W_]+)(?:_\w+)*_(\d+)_(\d+)_(.+)")
+
+
+def attempt_numbers(filenames: list[str]) -> list[int]:
+    """
+    Attempt numbers of one student's original filenames, from the "-i" suffix Canvas adds to resubmissions.
+    The suffix is found by comparing the filenames, as the filename itself may end in a number, like
+    "Assignment-04.zip". A number counts as a suffix if another file of the same type shares the name before it, or
+    if it is the suffix of another file, like a report first uploaded in a later attempt. Filenames without a suffix
+    are attempt 0.
+    """
+    names = [os.path.splitext(f) for f in filenames]
+    bases = [(res[1], ext) if (res := re.fullmatch(r"(.*)-(\d+)", stem)) else None for stem, ext in names]
+    numbers = []
+    for i, ((stem, _), base) in enumerate(zip(names, bases)):
+        others = [name for j, name in enumerate(names + bases) if j % len(names) != i]
+        numbers.append(int(stem.rpartition("-")[2]) if base and base in others else 0)
+    suffixes = set(numbers) - {0}
+    for i, ((stem, _), base) in enumerate(zip(names, bases)):
+        if base and not numbers[i] and int(stem.rpartition("-")[2]) in suffixes:
+            numbers[i] = int(stem.rpartition("-")[2])
+    return numbers
+
+
+def group_attempts(infos: list[zipfile.ZipInfo], by="time") -> dict[str, list[list[zipfile.ZipInfo]]]:
+    """
+    Group the entries of each student into attempts, from oldest to newest. Files uploaded in the same attempt, like
+    an archive and its report, share the timestamp and the "-i" suffix. Entries that don't follow the Canvas naming
+    format are left out.
+
+    :param infos: Entries of the Canvas ZIP file.
+    :param by: Either "time", to order the attempts by timestamp, using the suffix to break ties,
+        or "suffix", to order the attempts by the "-i" suffix, using the timestamp to break ties.
+    :return: Attempts of each student keyed by Canvas ID, each with its entries in the original order.
+    """
+    students: dict[str, list[tuple[zipfile.ZipInfo, str]]] = {}
+    for info in infos:
+        if res := CANVAS_NAME.match(info.filename):
+            students.setdefault(res[2], []).append((info, res[4]))
+
+    grouped = {}
+    for canvas_id, entries in students.items():
+        numbers = attempt_numbers([filename for _, filename in entries])
+        attempts: dict[tuple, list[zipfile.ZipInfo]] = {}
+        for (info, _), n in zip(entries, numbers):
+            attempts.setdefault((info.date_time, n) if by == "time" else (n, info.date_time), []).append(info)
+        grouped[canvas_id] = [attempts[rank] for rank in sorted(attempts)]
+    return grouped
+
+
+def latest_attempts(infos: list[zipfile.ZipInfo], by="time") -> list[zipfile.ZipInfo]:
+    """
+    Keep only the newest attempt of each student, with every file uploaded in it, in the original order. Entries that
+    don't follow the Canvas naming format are kept. See `group_attempts` for the parameters.
+    """
+    newest = {id(info) for attempts in group_attempts(infos, by).values() for info in attempts[-1]}
+    return [info for info in infos if id(info) in newest or not CANVAS_NAME.match(info.filename)]
@@ -0,0 +1,230 @@
+"""
+Persistent corpus of fingerprints from past terms' submissions and known solutions, to check new submissions against
+without uploading the old ones to MOSS again.
+
+The corpus is a folder that is only ever appended to:
+
+- `documents.jsonl` lists the documents, one per line. A document's ID is its line number. Adding a document with the
+  name, term and kind of one already stored replaces it: the older one is ignored from then on. Documents with the
+  same fingerprints as the one they would replace are not added again, so rerunning a term does not grow the corpus.
+- `segments/<n>.hashes` and `segments/<n>.docs` form the inverted index. Each pair of files holds the fingerprints
+  added at once, as sorted 64-bit hashes and the 32-bit ID of the document each hash is from.
+
+Segments are memory-mapped and searched with a binary search, so a lookup only touches the pages it needs.
+`compact` merges the segments into one when too many have piled up.
+"""
+
+import bisect
+import hashlib
+import heapq
+import json
+import mmap
+import os
+from array import array
+from dataclasses import dataclass, field
+
+import winnow
+from files import atomic_write
+
+
+@dataclass
+class Document:
+    name: str
+    term: str
+    kind: str
+    fingerprints: int
+    # SHA-256 of the sorted fingerprints, to tell whether a document added again changed
+    digest: str = ""
+
+    @property
+    def key(self) -> tuple[str, str, str]:
+        return self.term, self.kind, self.name
+
+
+@dataclass
+class Segment:
+    """One memory-mapped segment of the inverted index."""
+
+    hashes: memoryview
+    docs: memoryview
+    maps: list[mmap.mmap] = field(default_factory=list)
+
+    @classmethod
+    def open(cls, path: str) -> "Segment":
+        maps = []
+        views = []
+        for ext, typecode in ((".hashes", "Q"), (".docs", "I")):
+            with open(path + ext, "rb") as f:
+                maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            views.append(memoryview(maps[-1]).cast(typecode))
+        return cls(*views, maps=maps)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def lookup(self, h: int) -> memoryview:
+        """IDs of the documents containing the hash."""
+        start = bisect.bisect_left(self.hashes, h)
+        end = bisect.bisect_right(self.hashes, h, lo=start)
+        return self.docs[start:end]
+
+    def close(self) -> None:
+        self.hashes.release()
+        self.docs.release()
+        for m in self.maps:
+            m.close()
+
+
+class Corpus:
+    """
+    Fingerprint corpus stored in the folder at `path`. Created if it does not exist.
+
+    :param max_segments: Number of segments past which adding documents compacts the corpus.
+    """
+
+    def __init__(self, path: str, max_segments=16):
+        self.path = path
+        self.max_segments = max_segments
+        self.documents: list[Document] = []
+        # ID of the latest document of each name, term and kind, which replaces the earlier ones
+        self.latest: dict[tuple[str, str, str], int] = {}
+        self.segments: dict[str, Segment] = {}
+        os.makedirs(os.path.join(path, "segments"), exist_ok=True)
+        self.load()
+
+    def __enter__(self) -> "Corpus":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def load(self) -> None:
+        self.close()
+        self.documents = []
+        if os.path.exists(self.documents_path):
+            with open(self.documents_path) as f:
+                self.documents = [Document(**json.loads(line)) for line in f if line.strip()]
+        self.latest = {doc.key: doc_id for doc_id, doc in enumerate(self.documents)}
+
+        segments = os.path.join(self.path, "segments")
+        for name in sorted(os.listdir(segments)):
+            stem, ext = os.path.splitext(name)
+            if ext == ".hashes" and os.path.getsize(os.path.join(segments, name)):
+                self.segments[stem] = Segment.open(os.path.join(segments, stem))
+
+    def close(self) -> None:
+        for segment in self.segments.values():
+            segment.close()
+        self.segments = {}
+
+    @property
+    def documents_path(self) -> str:
+        return os.path.join(self.path, "documents.jsonl")
+
+    def add(
+        self, submissions: list[winnow.Fingerprints], term: str, kind="submission", base: winnow.Fingerprints = None
+    ) -> None:
+        """
+        Append the fingerprints of the submissions as new documents, in a single new segment. Fingerprints of the
+        base files are left out, as `lookup` ignores them. Submissions already stored with the same fingerprints are
+        skipped.
+        """
+        ignored = set(base.hashes) if base else set()
+        postings = []
+        documents = []
+        for fp in submissions:
+            unique = set(fp.hashes) - ignored
+            digest = hashlib.sha256(array("Q", sorted(unique)).tobytes()).hexdigest()
+            doc = Document(fp.name, term, kind, len(unique), digest)
+            if doc.key in self.latest and self.documents[self.latest[doc.key]].digest == digest:
+                continue
+            doc_id = len(self.documents) + len(documents)
+            postings.extend((h, doc_id) for h in unique)
+            documents.append(doc)
+        if not documents:
+            return
+
+        # Documents are written first, so an interrupted add leaves documents without fingerprints, and never
+        # fingerprints pointing to IDs that a later add reuses
+        with open(self.documents_path, "a") as f:
+            for doc in documents:
+                f.write(json.dumps(doc.__dict__) + "\n")
+        postings.sort()
+        self.write_segment(postings)
+        self.load()
+
+        if len(self.segments) > self.max_segments:
+            self.compact()
+
+    def write_segment(self, postings) -> None:
+        """Write the sorted `(hash, document ID)` pairs as a new segment."""
+        name = f"{int(max(self.segments, default='0')) + 1:06d}"
+        path = os.path.join(self.path, "segments", name)
+        hashes, docs = array("Q"), array("I")
+        for h, doc_id in postings:
+            hashes.append(h)
+            docs.append(doc_id)
+
+        # The .hashes file is what marks a segment as complete, so it is moved into place last
+        for ext, values in ((".docs", docs), (".hashes", hashes)):
+            with atomic_write(path + ext, "wb") as f:
+                values.tofile(f)
+
+    def compact(self) -> None:
+        """Merge every segment into one."""
+        old = list(self.segments)
+        segments = list(self.segments.values())
+        merged = heapq.merge(*(zip(s.hashes, s.docs) for s in segments))
+        self.write_segment(merged)
+        self.close()
+        for name in old:
+            for ext in (".hashes", ".docs"):
+                os.remove(os.path.join(self.path, "segments", name + ext))
+        self.load()
+
+    def current(self, doc_id: int, exclude_term: str = None) -> bool:
+        """Whether the document is the latest of its name, term and kind, and not of `exclude_term`."""
+        doc = self.documents[doc_id]
+        return self.latest[doc.key] == doc_id and doc.term != exclude_term
+
+    def postings(self, h: int, limit: int = None) -> list[int] | None:
+        """IDs of the documents containing the hash, or `None` if there are more than `limit`."""
+        found = [segment.lookup(h) for segment in self.segments.values()]
+        if limit is not None and sum(len(docs) for docs in found) > limit:
+            return None
+        return [doc_id for docs in found for doc_id in docs]
+
+    def lookup(
+        self, fp: winnow.Fingerprints, base: winnow.Fingerprints = None, max_docs=100, top=10, term: str = None
+    ) -> list[winnow.Match]:
+        """
+        Find the documents sharing the most fingerprints with the submission, ranked like `winnow.compare`.
+        Fingerprints of the base files, and fingerprints found in more than `max_docs` documents, are ignored.
+        Documents that were replaced, and documents of `term`, such as the submission's own copy from an earlier run,
+        are left out.
+        """
+        ignored = set(base.hashes) if base else set()
+        unique = set(fp.hashes) - ignored
+        shared: dict[int, set[int]] = {}
+        for h in unique:
+            for doc_id in self.postings(h, max_docs) or ():
+                if doc_id < len(self.documents) and self.current(doc_id, term):
+                    shared.setdefault(doc_id, set()).add(h)
+
+        matches = []
+        for doc_id, hashes in shared.items():
+            doc = self.documents[doc_id]
+            m = winnow.Match(
+                fp.name,
+                f"{doc.term}/{doc.name}",
+                len(hashes),
+                len(hashes) * 100 // max(len(unique), 1),
+                len(hashes) * 100 // max(doc.fingerprints, 1),
+            )
+            matches.append((m, hashes))
+        matches.sort(key=lambda x: (max(x[0].first_percent, x[0].second_percent), x[0].shared), reverse=True)
+
+        # Line ranges take a pass over the file, so they are only found for the top matches
+        for m, hashes in matches[:top]:
+            m.first_lines = fp.line_ranges(hashes)
+        return [m for m, _ in matches[:top]]
@@ -0,0 +1,175 @@
+"""
+Process many Canvas exports in one pass, such as every section and assignment of a course.
+
+Each export gets both the compliance check of `zipfile_check` and the similarity check of `mos_moss`, with the results
+saved in a folder named after the export. Extraction and compliance checks of all exports are scheduled on one shared
+pool of worker processes. Options after `--` are passed on to `mos_moss` for every export:
+
+    python driver.py cpp exports/*.zip -p A B -o course -- -b starters -n 20
+    python driver.py cpp --watch downloads -p A B -o course -- -b starters -n 20 --incremental
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import asdict
+
+import mos_moss
+import zipfile_check
+
+log = logging.getLogger()
+
+
+def check_export(export: str, parts: list[str], report: bool) -> list[zipfile_check.Submission]:
+    """Compliance pass of one export, run in a worker process."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return zipfile_check.check_zipfile(export, parts, report, tree=True)
+
+
+def process_export(export: str, language: str, output: str, pool: Executor, parts=None, report=True, moss_args=()):
+    """
+    Run the compliance and similarity passes of one export, saving the results in `output/<export name>`.
+    The compliance pass runs in the pool while the export is extracted and sent to MOSS.
+    """
+    threading.current_thread().name = name = os.path.splitext(os.path.basename(export))[0]
+    folder = os.path.join(output, name)
+    os.makedirs(folder, exist_ok=True)
+
+    compliance = pool.submit(check_export, export, parts, report)
+    opt = mos_moss.parse_args(
+        [export, language, "-o", os.path.join(folder, "zip_output"), "-ro", os.path.join(folder, "report"), *moss_args]
+    )
+    mos_moss.run(opt, pool=pool)
+
+    submissions = compliance.result()
+    with open(os.path.join(folder, "compliance.json"), "w") as f:
+        json.dump([asdict(s) for s in submissions], f, indent=2)
+    bad = sum(1 for s in submissions if not s.compliance)
+    log.info(f"{name}: {len(submissions)} submissions, {bad} non-compliant")
+
+
+def ready_exports(folder: str, sizes: dict[str, tuple[int, int]]) -> list[str]:
+    """
+    Canvas exports in the folder that are done downloading, i.e., whose size and modification time have not changed
+    since the last call. `sizes` keeps track of them between calls.
+    """
+    ready = []
+    for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+        if not entry.name.endswith(".zip") or not entry.is_file():
+            continue
+        stat = entry.stat()
+        current = (stat.st_size, stat.st_mtime_ns)
+        if sizes.get(entry.path) == current:
+            ready.append(entry.path)
+        sizes[entry.path] = current
+    return ready
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run the compliance and similarity checks of many Canvas exports in one pass.",
+        epilog="Options after -- are passed on to mos_moss.py for every export.",
+    )
+
+    parser.add_argument("language", help="Programming language for the assignments.")
+    parser.add_argument("exports", nargs="*", help="Canvas ZIP files to process.")
+    parser.add_argument(
+        "--watch", metavar="path", help="Process Canvas ZIP files as they are added to this folder, or replaced."
+    )
+    parser.add_argument(
+        "--interval", metavar="seconds", help="How often to look for new files to watch.", type=float, default=10.0
+    )
+    parser.add_argument("-o", "--output", metavar="path", help="Folder to save results in.", default="./course")
+    parser.add_argument("-p", "--parts", nargs="+", help="Name of the parts required in each submission.")
+    parser.add_argument("--no-report", help="Do not check for the report in submissions.", action="store_true")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="n",
+        help="Number of worker processes shared by all exports.",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument("--at-once", metavar="n", help="Number of exports processed at once.", type=int, default=4)
+
+    args = sys.argv[1:]
+    split = args.index("--") if "--" in args else len(args)
+    opt = parser.parse_args(args[:split])
+    opt.moss_args = args[split + 1 :]
+    if not opt.exports and not opt.watch:
+        parser.error("give at least one Canvas export, or a folder to --watch")
+    return opt
+
+
+def main():
+    opt = parse_args()
+    mos_moss.setup_logger()
+    log.setLevel(logging.DEBUG if "--verbose" in opt.moss_args else logging.INFO)
+
+    started: dict[str, Future] = {}
+    # Size and modification time of each export when it was started, to process it again once it changes
+    versions: dict[str, tuple[int, int]] = {}
+    reported = set()
+    sizes = {}
+    # Workers ignore Ctrl+C, which stops watching, so the exports in progress can finish
+    pool = ProcessPoolExecutor(
+        max_workers=opt.jobs, initializer=signal.signal, initargs=(signal.SIGINT, signal.SIG_IGN)
+    )
+    with pool, ThreadPoolExecutor(max_workers=opt.at_once) as threads:
+
+        def start(export: str, version: tuple[int, int] = None) -> None:
+            """Process the export, or process it again if its size or modification time changed since it started."""
+            if version is None:
+                stat = os.stat(export)
+                version = (stat.st_size, stat.st_mtime_ns)
+            export = os.path.abspath(export)
+            if export in started and (versions[export] == version or not started[export].done()):
+                # A new download of an export still in progress is picked up once it finishes
+                return
+            log.info(f"{'Processing again' if export in started else 'Processing'} {export}")
+            versions[export] = version
+            reported.discard(export)
+            started[export] = threads.submit(
+                process_export,
+                export,
+                opt.language,
+                opt.output,
+                pool,
+                parts=opt.parts,
+                report=not opt.no_report,
+                moss_args=opt.moss_args,
+            )
+
+        def finished() -> None:
+            for export, future in started.items():
+                if future.done() and export not in reported:
+                    reported.add(export)
+                    if e := future.exception():
+                        log.error(f"Failed to process {export}: {type(e).__name__}: {e}")
+
+        for export in opt.exports:
+            start(export)
+
+        try:
+            while opt.watch:
+                for export in ready_exports(opt.watch, sizes):
+                    start(export, sizes[export])
+                finished()
+                time.sleep(opt.interval)
+        except KeyboardInterrupt:
+            log.info("Stopped watching, waiting for the exports in progress")
+
+        wait(started.values())
+        finished()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""Helpers for the files the pipeline keeps between runs, such as the journal, the manifest and cached copies."""
+
+import contextlib
+import os
+import threading
+from collections.abc import Iterator
+from typing import IO
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode="w", **kwargs) -> Iterator[IO]:
+    """
+    Open a file to write in place of `path`, moved over it once the block finishes. Readers, and runs that resume
+    after an interruption, see either the previous file or the complete new one.
+    The temporary name is unique to the process and thread, so concurrent writers of the same path don't clash.
+    """
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
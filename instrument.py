@@ -0,0 +1,115 @@
+"""
+Spans for timing each stage of the pipelines.
+
+Wrap a stage in `span` to record its wall and CPU time, along with any counts or byte volumes added to the dict it
+yields. Nothing is recorded unless `enable` was called. `dump` writes the spans as a Chrome trace, viewable in
+chrome://tracing or https://ui.perfetto.dev, with a per-stage summary under "summary".
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+
+enabled = False
+profiler: cProfile.Profile = None
+
+_spans: list[dict] = []
+_lock = threading.Lock()
+
+
+def enable(cprofile=False) -> None:
+    global enabled, profiler
+    enabled = True
+    if cprofile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+
+def record(name: str, start: float, end: float, cpu: float, **args) -> None:
+    """Record a span that was timed by the caller, with `time.perf_counter` and `time.thread_time`."""
+    if not enabled:
+        return
+    with _lock:
+        _spans.append(
+            {
+                "name": name,
+                "start": start,
+                "wall": end - start,
+                "cpu": cpu,
+                "pid": os.getpid(),
+                "thread": threading.current_thread().name,
+                "args": args,
+            }
+        )
+
+
+@contextlib.contextmanager
+def span(name: str, **args):
+    """Time the block. Counts and byte volumes can be added to the yielded dict."""
+    start, start_cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield args
+    finally:
+        record(name, start, time.perf_counter(), time.thread_time() - start_cpu, **args)
+
+
+def drain() -> list[dict]:
+    """Remove and return the spans recorded by this process, to send them back from a worker process."""
+    global _spans
+    with _lock:
+        spans = [s for s in _spans if s["pid"] == os.getpid()]
+        _spans = []
+    return spans
+
+
+def merge(spans: list[dict]) -> None:
+    """Add spans recorded by a worker process."""
+    with _lock:
+        _spans.extend(spans)
+
+
+def summary() -> dict[str, dict]:
+    """Total count, wall time, CPU time and numeric arguments, such as bytes, of each kind of span."""
+    stages = {}
+    for s in _spans:
+        stage = stages.setdefault(s["name"], {"count": 0, "wall": 0.0, "cpu": 0.0})
+        stage["count"] += 1
+        stage["wall"] += s["wall"]
+        stage["cpu"] += s["cpu"]
+        for k, v in s["args"].items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                stage[k] = stage.get(k, 0) + v
+    return stages
+
+
+def dump(path: str, cprofile_path: str = None) -> None:
+    """Write the spans as a Chrome trace, and the cProfile capture if one was taken."""
+    if profiler:
+        profiler.disable()
+        if cprofile_path:
+            profiler.dump_stats(cprofile_path)
+
+    origin = min((s["start"] for s in _spans), default=0.0)
+    threads = {}
+    events = []
+    for s in _spans:
+        tid = threads.setdefault((s["pid"], s["thread"]), len(threads))
+        events.append(
+            {
+                "name": s["name"],
+                "ph": "X",
+                "ts": (s["start"] - origin) * 1e6,
+                "dur": s["wall"] * 1e6,
+                "pid": s["pid"],
+                "tid": tid,
+                "args": {"cpu": s["cpu"], **s["args"]},
+            }
+        )
+    for (pid, thread), tid in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}})
+
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "summary": summary()}, f, indent=1)
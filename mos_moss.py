@@ -1,18 +1,34 @@
 import argparse
-import glob
+import contextlib
+import hashlib
+import json
 import logging
-import logging.handlers
 import os
 import pprint
 import random
 import re
 import shutil
 import sys
+import threading
+import time
 import zipfile
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple
 
-import mosspy
+import instrument
+import winnow
+from archive import CanvasZip, StudentArchive, safe_name
+from canvas_export import CANVAS_NAME, latest_attempts
+from corpus import Corpus
+from files import atomic_write
+from normalize import Normalizer
+
+# mosspy and report_index are imported by the stages that use them, so extract-only runs start quickly
+if TYPE_CHECKING:
+    import mosspy
 
 # Set your MOSS ID here or in your environment variable.
 MOSS_ID = "1234"
@@ -22,48 +38,235 @@ LANGUAGE_EXTENSIONS: dict[str, list[str]] = {
     "cpp": [".cpp", ".h", ".hpp"],
 }
 
+# Never extracted from student's submissions.
+IGNORED_FOLDERS = {
+    "__MACOSX",
+    "__pycache__",
+    ".git",
+    ".svn",
+    ".idea",
+    ".vs",
+    ".vscode",
+    "node_modules",
+    "cmake-build-debug",
+    "cmake-build-release",
+    "build",
+    "Debug",
+    "Release",
+    "x64",
+    "bin",
+    "obj",
+    "out",
+    "target",
+}
+IGNORED_FILES = {".DS_Store", "Thumbs.db", "desktop.ini"}
+IGNORED_EXTENSIONS = {
+    ".exe",
+    ".out",
+    ".o",
+    ".obj",
+    ".a",
+    ".lib",
+    ".so",
+    ".dll",
+    ".dylib",
+    ".pdb",
+    ".ilk",
+    ".gch",
+    ".pch",
+    ".class",
+    ".jar",
+    ".zip",
+    ".7z",
+    ".rar",
+    ".tar",
+    ".gz",
+}
+
 log = logging.getLogger()
 
+# Options that can differ between a run and its resumption
+RESUME_IGNORED_OPTIONS = {"resume", "verbose", "profile", "cprofile", "jobs", "concurrency", "retries", "moss_server"}
+
+
+@dataclass
+class ExtractPolicy:
+    """
+    Which members of a student's ZIP file are extracted. Members are checked against the central directory,
+    so skipped members are never decompressed.
+
+    :param extensions: Only extract files with these extensions, such as those of the assignment's language.
+    :param max_bytes: Maximum number of bytes extracted per student.
+    :param max_files: Maximum number of files extracted per student.
+    """
+
+    extensions: tuple[str, ...] = ()
+    max_bytes: int = 50 * 2**20
+    max_files: int = 2000
+
+    def skip(self, name: str) -> bool:
+        parts = name.split("/")
+        if name.endswith("/") or any(part in IGNORED_FOLDERS for part in parts[:-1]):
+            return True
+        if parts[-1] in IGNORED_FILES or os.path.splitext(parts[-1])[1].lower() in IGNORED_EXTENSIONS:
+            return True
+        return bool(self.extensions) and not name.endswith(self.extensions)
+
+
+def extract_student_archive(archive: StudentArchive, path: str, policy: ExtractPolicy) -> tuple[int, int, int]:
+    """
+    Extract the members of the student's archive allowed by the policy into `path`.
+    If everything is in a single folder, and nothing was extracted into `path` yet, that folder is flattened.
+
+    :return: Number of files and bytes extracted, and the number of members skipped.
+    """
+    infos = archive.members()
+    members = [info for info in infos if not policy.skip(info.name)]
+
+    prefix = ""
+    folders = {info.name.split("/")[0] for info in members}
+    if len(folders) == 1 and all("/" in info.name for info in members):
+        if not (os.path.isdir(path) and os.listdir(path)):
+            prefix = folders.pop() + "/"
+            log.debug(f"Flattening {prefix} into {path}")
+
+    allowed = []
+    size = 0
+    for info in members:
+        if len(allowed) >= policy.max_files or size + info.size > policy.max_bytes:
+            log.warning(
+                f"{path} is over the limit of {policy.max_files} files or {policy.max_bytes} bytes, "
+                f"skipping {len(members) - len(allowed)} file(s)"
+            )
+            break
+        allowed.append(info)
+        size += info.size
+
+    for info, f in archive.read(allowed):
+        # Only the extracted name is rewritten, the member is still read by its original name
+        name = safe_name(info.name.removeprefix(prefix))
+        if not name:
+            continue
+        target = os.path.join(path, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as out:
+            shutil.copyfileobj(f, out, 2**20)
+
+    return len(allowed), size, len(infos) - len(allowed)
+
+
+def extract_loose_file(zf: CanvasZip, info: zipfile.ZipInfo, path: str, policy: ExtractPolicy) -> tuple[int, int, int]:
+    """
+    Copy a file the student uploaded next to their archive, like the report, into `path` under its original name.
+
+    :return: Number of files and bytes extracted, and the number of members skipped, like `extract_student_archive`.
+    """
+    res = CANVAS_NAME.match(info.filename)
+    name = safe_name(res[4] if res else info.filename)
+    if not name or policy.skip(name) or info.file_size > policy.max_bytes:
+        return 0, 0, 1
+    os.makedirs(path, exist_ok=True)
+    with zf.open_member(info) as f, open(os.path.join(path, name), "wb") as out:
+        shutil.copyfileobj(f, out, 2**20)
+    return 1, info.file_size, 0
+
+
+def _extract_student_zips(canvas_zip, members: list[str], path: str, policy: ExtractPolicy) -> None:
+    """
+    Extract the given student archives from the Canvas ZIP file into `path`.
+    Members sharing a folder are extracted in order, so later attempts overlay earlier ones. Files uploaded next to
+    an archive are copied after the archives, so they don't stop an archive from being flattened.
+    """
+    with CanvasZip(canvas_zip) as zf:
+        infos = [zf.getinfo(member) for member in members]
+        archives = [info for info in infos if zf.is_archive(info)]
+        for info in archives + [info for info in infos if info not in archives]:
+            with instrument.span("extract", member=info.filename) as s:
+                if info not in archives:
+                    s["files"], s["bytes"], s["skipped"] = extract_loose_file(zf, info, path, policy)
+                    continue
+                with zf.open_archive(info) as archive:
+                    s["files"], s["bytes"], s["skipped"] = extract_student_archive(archive, path, policy)
+
+
+def _extract_in_worker(canvas_zip, members: list[str], path: str, policy: ExtractPolicy, profile: bool) -> list[dict]:
+    """Run `_extract_student_zips` in a worker process, returning the spans it recorded."""
+    instrument.enabled = profile
+    _extract_student_zips(canvas_zip, members, path, policy)
+    return instrument.drain()
+
+
+def manifest_path(zip_output: str) -> str:
+    return os.path.normpath(zip_output) + ".manifest.json"
 
-def cleanup_files(path):
-    """Currently just removes __MACOSX folders."""
-    macos_folders = glob.glob(f"{path}/**/__MACOSX", recursive=True)
-    for f in macos_folders:
-        shutil.rmtree(f)
 
+def read_manifest(zip_output: str) -> dict[str, dict]:
+    """Read the manifest of student ZIPs extracted into `zip_output` by a previous run, if any."""
+    path = manifest_path(zip_output)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
 
-def flatten_folder(destination):
-    """Flatten folders containing a single folder."""
-    content = os.listdir(destination)
-    if len(content) == 1:
-        folder = os.path.join(destination, content[0])
-        if os.path.isdir(folder):
-            log.debug(f"Flattening {folder}")
-            for f in os.listdir(folder):
-                shutil.move(os.path.join(folder, f), destination)
-            os.rmdir(folder)
 
+def write_manifest(zip_output: str, manifest: dict[str, dict]) -> None:
+    Path(zip_output).mkdir(parents=True, exist_ok=True)
+    with atomic_write(manifest_path(zip_output)) as f:
+        json.dump(manifest, f, indent=2)
 
-def unzip_canvas_submission(canvas_zip, zip_output, original_name=False) -> None:
+
+def unzip_canvas_submission(
+    canvas_zip,
+    zip_output,
+    original_name=False,
+    jobs=1,
+    incremental=False,
+    policy: ExtractPolicy = None,
+    all_attempts=False,
+    latest_by="time",
+    executor: Executor = None,
+) -> tuple[list[str], dict[str, str]]:
     """
     Unzip the Canvas submission folder and place them in a folder.
     Set `original_name` to `True` to keep student's ZIP file original name.
     This doesn't work consistently, notably with resubmissions.
 
+    The CRC, size and folder of every student ZIP is recorded in a manifest next to `zip_output`.
+    Set `incremental` to `True` to extract into a non-empty `zip_output`, only extracting the student ZIPs
+    that are new or changed since the manifest was written.
+
     :param canvas_zip: Path to ZIP file generated by Canvas
     :param zip_output: Path to extract the ZIP files.
     :param original_name: Whether to extract into folders with the original ZIP name.
-    :return: None
+    :param jobs: Number of worker processes used to extract student ZIPs.
+    :param incremental: Whether to only extract new or changed student ZIPs.
+    :param policy: Which members of the student ZIPs to extract. By default, skips junk such as __MACOSX folders,
+        version control, build outputs and binaries.
+    :param all_attempts: Whether to extract every attempt, instead of only each student's latest attempt.
+    :param latest_by: How to find the latest attempt, either by "time" or by "suffix". See `latest_attempts`.
+    :param executor: Process pool shared with other work to extract the student ZIPs with, instead of starting one.
+    :return: Folder names that were extracted, and a mapping of folder names that failed to extract to the error.
     """
     # If path already exists, first check if we should write to it.
     if os.path.exists(zip_output):
         if not os.path.isdir(zip_output):
             raise TypeError(f"{zip_output} is not a directory.")
-        if os.listdir(zip_output):
+        if os.listdir(zip_output) and not incremental:
             raise FileExistsError(f"{zip_output} is not empty.")
 
+    policy = policy or ExtractPolicy()
+
+    # Group student ZIPs by destination folder first. Resubmissions that map to the same
+    # folder are handled by a single worker, in archive order, so the result is deterministic.
+    folders: dict[str, list[str]] = {}
+    manifest: dict[str, dict] = {}
     with zipfile.ZipFile(canvas_zip, "r") as zf:
-        for submission in zf.infolist():
+        submissions = zf.infolist()
+        if not all_attempts:
+            submissions = latest_attempts(submissions, by=latest_by)
+            log.info(f"Extracting the latest attempt of {len(submissions)} submission(s) out of {len(zf.infolist())}")
+
+        for submission in submissions:
             # Canvas ZIP name format (may contain -i
             # at the end for resubmissions, where i is the attempt number):
             # <last><first>_<canvas_id>_<sis_id>_<original_filename>[-i]
@@ -73,16 +276,166 @@ def unzip_canvas_submission(canvas_zip, zip_output, original_name=False) -> None
             except TypeError:  # if match returns None
                 log.warning("Could parse the Canvas ZIP file, did the format change?")
                 folder_name = submission.filename
+            folders.setdefault(folder_name, []).append(submission.filename)
+            manifest[submission.filename] = {"crc": submission.CRC, "size": submission.file_size, "folder": folder_name}
 
-            log.debug(f"Extracting {folder_name}")
+    if incremental:
+        previous = read_manifest(zip_output)
+        previous_folders: dict[str, set[str]] = {}
+        for member, entry in previous.items():
+            previous_folders.setdefault(entry["folder"], set()).add(member)
+
+        changed = [
+            f
+            for f, members in folders.items()
+            if set(members) != previous_folders.get(f) or any(previous.get(m) != manifest[m] for m in members)
+        ]
+        log.info(f"{len(changed)} of {len(folders)} submission(s) are new or changed")
+        removed = [f for f in previous_folders if f not in folders]
+    else:
+        changed, removed = list(folders), []
+
+    # The manifest only lists the folders extracted so far, and is written again as each one finishes.
+    # An interrupted run then only extracts the rest when run again incrementally.
+    extracted = {m: entry for m, entry in manifest.items() if entry["folder"] not in changed}
+    write_manifest(zip_output, extracted)
+
+    # Folders of attempts that were superseded are removed along with changed ones
+    for folder_name in changed + removed:
+        path = os.path.join(zip_output, folder_name)
+        if os.path.exists(path):
+            shutil.rmtree(path)
 
-            b = zf.open(submission, "r")
-            with zipfile.ZipFile(b) as student_zip:
+    def finished(folder_name: str) -> None:
+        extracted.update({m: manifest[m] for m in folders[folder_name]})
+        write_manifest(zip_output, extracted)
+
+    failures = {}
+    if jobs > 1 or executor:
+        with contextlib.ExitStack() as stack:
+            if not executor:
+                # Imported here, as multiprocessing is slow to import and only needed with several jobs
+                from concurrent.futures import ProcessPoolExecutor
+
+                executor = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+            futures = {}
+            for folder_name in changed:
+                log.debug(f"Extracting {folder_name}")
                 path = os.path.join(zip_output, folder_name)
+                future = executor.submit(
+                    _extract_in_worker, canvas_zip, folders[folder_name], path, policy, instrument.enabled
+                )
+                futures[future] = folder_name
+            for future in as_completed(futures):
+                try:
+                    instrument.merge(future.result())
+                except Exception as e:
+                    failures[futures[future]] = f"{type(e).__name__}: {e}"
+                else:
+                    finished(futures[future])
+    else:
+        for folder_name in changed:
+            log.debug(f"Extracting {folder_name}")
+            try:
+                _extract_student_zips(canvas_zip, folders[folder_name], os.path.join(zip_output, folder_name), policy)
+            except Exception as e:
+                failures[folder_name] = f"{type(e).__name__}: {e}"
+            else:
+                finished(folder_name)
+
+    for folder_name in sorted(failures):
+        log.error(f"Failed to extract {folder_name}: {failures[folder_name]}")
+    if failures:
+        log.warning(f"{len(failures)} of {len(folders)} submission(s) could not be extracted")
+
+    # Failed submissions are left out of the manifest, so they are extracted again next time
+    return [f for f in changed if f not in failures], failures
+
 
-                student_zip.extractall(path=path)
-                cleanup_files(path)
-                flatten_folder(path)
+class IndexedFile(NamedTuple):
+    path: str
+    size: int
+    mtime: int
+
+
+def walk_files(folder: str) -> Iterator[IndexedFile]:
+    """Recursively yield the files in `folder`, in sorted order. Hidden files and folders are skipped, like `glob`."""
+    with os.scandir(folder) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir():
+            yield from walk_files(entry.path)
+        elif entry.is_file():
+            stat = entry.stat()
+            yield IndexedFile(entry.path, stat.st_size, stat.st_mtime_ns)
+
+
+@dataclass
+class FileIndex:
+    """
+    Files under one or more root folders, found with a single walk of each root.
+    Files are grouped by submission folder, i.e., the top-level folders of a root.
+    Files placed directly in a root are grouped under the root itself.
+    """
+
+    roots: dict[str, list[str]] = field(default_factory=dict)
+    folders: dict[str, list[IndexedFile]] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, *roots: str) -> "FileIndex":
+        index = cls()
+        for root in roots:
+            if root:
+                index.add_root(root)
+        return index
+
+    def add_root(self, root: str) -> None:
+        self.roots[root] = [root]
+        self.folders[root] = []
+        if not os.path.isdir(root):
+            return
+
+        with os.scandir(root) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                self.roots[root].append(entry.path)
+                self.folders[entry.path] = list(walk_files(entry.path))
+            elif entry.is_file():
+                stat = entry.stat()
+                self.folders[root].append(IndexedFile(entry.path, stat.st_size, stat.st_mtime_ns))
+
+    def submission_folders(self, root: str) -> list[str]:
+        """List the submission folders of an indexed root."""
+        return self.roots[root][1:]
+
+    def indexed_files(self, folder: str, language="") -> list[IndexedFile]:
+        """
+        List files from an indexed root or submission folder. Only files that match the extension
+        of the language are listed.
+        """
+        extensions = tuple(LANGUAGE_EXTENSIONS.get(language.lower(), ""))
+        files = []
+        for bucket in self.roots.get(folder, [folder]):
+            for f in self.folders.get(bucket, []):
+                if f.path.endswith(extensions) and not f.path.endswith(("pdf", "jar")) and f.size > 0:
+                    files.append(f)
+        return files
+
+    def list_files(self, folder: str, language="") -> list[str]:
+        return [f.path for f in self.indexed_files(folder, language)]
+
+    def group(self, files: Iterable[str]) -> dict[str, list[str]]:
+        """Group indexed files by the submission folder they are in."""
+        owners = {f.path: folder for folder, indexed in self.folders.items() for f in indexed}
+        groups = {}
+        for path in files:
+            groups.setdefault(owners.get(path, path), []).append(path)
+        return groups
 
 
 def list_files(folder: str, language="") -> list[str]:
@@ -91,15 +444,254 @@ def list_files(folder: str, language="") -> list[str]:
     resulting list will only contain files that match the extension of the
     language.
     """
-    files = []
-    for ext in LANGUAGE_EXTENSIONS.get(language.lower(), ""):
-        files += glob.glob(f"{folder}/**/*{ext}", recursive=True)
+    return FileIndex.build(folder).list_files(folder, language)
 
-    new_files = []
-    for f in files:
-        if os.path.isfile(f) and not f.endswith("pdf") and not f.endswith("jar") and os.path.getsize(f) > 0:
-            new_files.append(f)
-    return new_files
+
+@dataclass
+class HashStore:
+    """
+    SHA-256 of indexed files, persisted as JSON next to the extraction folder. Entries are reused while a file's
+    size and modification time are unchanged, so reruns only hash new or modified files.
+    """
+
+    path: str
+    entries: dict[str, list] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, zip_output: str) -> "HashStore":
+        store = cls(os.path.normpath(zip_output) + ".sha256.json")
+        if os.path.exists(store.path):
+            with open(store.path) as f:
+                store.entries = json.load(f)
+        return store
+
+    def save(self) -> None:
+        with atomic_write(self.path) as f:
+            json.dump(self.entries, f)
+
+    def digest(self, f: IndexedFile) -> str:
+        key = os.path.abspath(f.path)
+        entry = self.entries.get(key)
+        if entry and entry[:2] == [f.size, f.mtime]:
+            return entry[2]
+
+        with open(f.path, "rb") as fp:
+            digest = hashlib.file_digest(fp, "sha256").hexdigest()
+        self.entries[key] = [f.size, f.mtime, digest]
+        return digest
+
+
+@dataclass
+class Journal:
+    """
+    Progress of a run, persisted as JSON next to the extraction folder, so an interrupted run can be resumed.
+    Records the submissions extracted, the batches planned and the number of the first one, and how far each batch
+    got: "sent" once MOSS returned the report URL, "saved" once the report page is saved, and "done" once the report
+    is downloaded.
+    """
+
+    path: str | None
+    options: dict = field(default_factory=dict)
+    extracted: list[str] = None
+    batches: list[list[str] | None] = None
+    first_batch: int = 1
+    progress: dict[str, dict] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    STATES = ("sent", "saved", "done")
+
+    @classmethod
+    def start(cls, zip_output: str, options: dict, resume=False) -> "Journal":
+        """
+        Start the journal of a new run, or with `resume`, load the journal of the previous run.
+        Resuming a run started with different options raises a `ValueError`.
+        """
+        journal = cls(os.path.normpath(zip_output) + ".journal.json", options)
+        if not resume:
+            return journal
+        if not os.path.exists(journal.path):
+            log.warning(f"No journal found at {journal.path}, starting from the beginning")
+            return journal
+
+        with open(journal.path) as f:
+            saved = json.load(f)
+        if saved["options"] != options:
+            raise ValueError(f"{journal.path} was written by a run with different options, run without --resume")
+        journal.extracted = saved["extracted"]
+        journal.batches = saved["batches"]
+        journal.progress = saved["progress"]
+        journal.first_batch = saved.get("first_batch", 1)
+        log.info(f"Resuming from {journal.path}")
+        return journal
+
+    def save(self) -> None:
+        """Write the journal. A journal without a path is only kept in memory."""
+        if not self.path:
+            return
+        with atomic_write(self.path) as f:
+            json.dump(
+                {
+                    "options": self.options,
+                    "extracted": self.extracted,
+                    "batches": self.batches,
+                    "first_batch": self.first_batch,
+                    "progress": self.progress,
+                },
+                f,
+                indent=2,
+            )
+
+    def reached(self, batch: int, state: str) -> bool:
+        """Whether the batch got to `state` or past it."""
+        current = self.progress.get(str(batch), {}).get("state")
+        return current is not None and self.STATES.index(current) >= self.STATES.index(state)
+
+    def update(self, batch: int, **fields) -> None:
+        with self.lock:
+            self.progress.setdefault(str(batch), {}).update(fields)
+            self.save()
+
+
+def find_exact_copies(
+    index: FileIndex, zip_output: str, language: str, hashes: HashStore, base_files=None
+) -> dict[str, list[str]]:
+    """
+    Find files that are byte-for-byte identical across submission folders, keyed by their SHA-256.
+    Files identical to a base file are left out.
+    """
+    base = {hashes.digest(f) for f in index.indexed_files(base_files, language)} if base_files else set()
+
+    owners: dict[str, dict[str, list[str]]] = {}
+    for folder in index.submission_folders(zip_output):
+        for f in index.indexed_files(folder, language):
+            digest = hashes.digest(f)
+            if digest not in base:
+                owners.setdefault(digest, {}).setdefault(folder, []).append(f.path)
+
+    return {
+        digest: [path for paths in folders.values() for path in paths]
+        for digest, folders in owners.items()
+        if len(folders) > 1
+    }
+
+
+def check_corpus(
+    corpus: Corpus, index: FileIndex, zip_output: str, language: str, base_files=None, term: str = None, solutions=None
+) -> dict[str, list[dict]]:
+    """
+    Check each submission folder against the fingerprints of past terms and known solutions in the corpus,
+    returning the best matches of each. If `term` is given, the submissions and solutions are then added to the corpus.
+    """
+    folders = {os.path.basename(f): index.list_files(f, language) for f in index.submission_folders(zip_output)}
+    submissions = [fp for fp in winnow.fingerprint(folders) if fp.files]
+    base = winnow.fingerprint({"base": index.list_files(base_files, language)})[0] if base_files else None
+
+    results = {}
+    for fp in submissions:
+        results[fp.name] = [asdict(m) for m in corpus.lookup(fp, base, term=term)]
+
+    if term:
+        corpus.add(submissions, term, base=base)
+        if solutions:
+            # Each solution is either a folder, or a single file directly in the solutions folder
+            files = {os.path.basename(f): index.list_files(f, language) for f in index.submission_folders(solutions)}
+            loose = {f.path for f in index.folders[solutions]}
+            files.update((os.path.basename(f), [f]) for f in index.list_files(solutions, language) if f in loose)
+            corpus.add([fp for fp in winnow.fingerprint(files) if fp.files], term, kind="solution", base=base)
+    return results
+
+
+def plan_batches(
+    folders: list[str],
+    max_submissions: int,
+    weights: dict[str, int] = None,
+    changed: set[str] = None,
+    sizes: dict[str, tuple[int, int]] = None,
+    max_bytes=0,
+    max_files=0,
+) -> list[list[str]]:
+    """
+    Plan batches of at most `max_submissions` folders so that every pair of folders shares at least one batch.
+    If `changed` is given, only pairs with at least one changed folder need to share a batch.
+
+    Batches are built greedily: each batch starts from the folder with the most pairs left to cover, then adds
+    the folder that covers the most new pairs with the folders already in the batch. If `weights` is given,
+    such as the number of bytes to upload for each folder, new pairs are counted per unit of weight instead.
+
+    If `sizes` gives the bytes and number of files of each folder, batches are also kept within `max_bytes` and
+    `max_files`. Pairs of folders that do not fit in a batch together are left out, see `oversized`.
+    """
+    if changed is not None and not changed:
+        return []
+    if max_submissions and max_submissions < 2:
+        raise ValueError("Batches need room for at least 2 submissions to compare them")
+    max_submissions = max_submissions or len(folders)
+    load = [sizes.get(f, (0, 0)) if sizes else (0, 0) for f in folders]
+
+    def fits(total: tuple[int, int], i: int) -> bool:
+        return within(total[0] + load[i][0], total[1] + load[i][1], max_bytes, max_files)
+
+    if len(folders) <= max_submissions and within(
+        sum(b for b, _ in load), sum(n for _, n in load), max_bytes, max_files
+    ):
+        return [list(folders)]
+
+    weight = [max(weights.get(f, 1), 1) if weights else 1 for f in folders]
+    everyone = (1 << len(folders)) - 1
+    if changed is not None:
+        modified = sum(1 << i for i, f in enumerate(folders) if f in changed)
+        everyone = [everyone if f in changed else modified for f in folders]
+    else:
+        everyone = [everyone] * len(folders)
+    # Bit j of uncovered[i] is set while folders i and j have not been in a batch together
+    uncovered = [everyone[i] & ~(1 << i) for i in range(len(folders))]
+    if sizes and (max_bytes or max_files):
+        for i in range(len(folders)):
+            too_big = sum(1 << j for j in range(len(folders)) if not (fits((0, 0), i) and fits(load[i], j)))
+            uncovered[i] &= ~too_big
+
+    batches = []
+    while any(uncovered):
+        first = max(range(len(folders)), key=lambda i: uncovered[i].bit_count() / weight[i])
+        batch, members, total = [first], 1 << first, load[first]
+        while len(batch) < max_submissions:
+            candidates = [i for i in range(len(folders)) if not members >> i & 1 and fits(total, i)]
+            if not candidates:
+                break
+            best = max(
+                candidates,
+                key=lambda i: ((uncovered[i] & members).bit_count() / weight[i], uncovered[i].bit_count()),
+            )
+            batch.append(best)
+            members |= 1 << best
+            total = (total[0] + load[best][0], total[1] + load[best][1])
+
+        for i in batch:
+            uncovered[i] &= ~members
+        batches.append([folders[i] for i in sorted(batch)])
+
+    return batches
+
+
+def within(size: int, files: int, max_bytes=0, max_files=0) -> bool:
+    """Whether a batch of this many bytes and files is within the limits. A limit of 0 means no limit."""
+    return (not max_bytes or size <= max_bytes) and (not max_files or files <= max_files)
+
+
+def oversized(folders: list[str], sizes: dict[str, tuple[int, int]], max_bytes=0, max_files=0) -> tuple[list[str], int]:
+    """
+    Folders too large to fit in any batch on their own, and the number of other pairs of folders too large to
+    fit in a batch together. Neither can be compared by MOSS within the limits.
+    """
+    alone = [f for f in folders if not within(*sizes[f], max_bytes, max_files)]
+    rest = [sizes[f] for f in folders if f not in alone]
+    pairs = sum(
+        1
+        for i, a in enumerate(rest)
+        for b in rest[i + 1 :]
+        if not within(a[0] + b[0], a[1] + b[1], max_bytes, max_files)
+    )
+    return alone, pairs
 
 
 def create_moss_comments(**kwargs) -> str:
@@ -116,47 +708,94 @@ def create_moss_comments(**kwargs) -> str:
     return "<br><br>".join(msg)
 
 
+def display_name(path: str) -> str:
+    """Name a file is uploaded under, the same way `mosspy` names files without a display name."""
+    return path.replace(" ", "_").replace("\\", "/")
+
+
 def stage_moss_files(
     zip_output: str,
     language: str = "",
     max_submissions=0,
     base_files=None,
     solutions=None,
-) -> mosspy.Moss:
+    index: FileIndex = None,
+    submission_folders: list[str] = None,
+    hashes: HashStore = None,
+    collapse_copies=False,
+    normalizer: Normalizer = None,
+) -> "mosspy.Moss":
+    import mosspy
+
+    start, start_cpu = time.perf_counter(), time.thread_time()
     moss = mosspy.Moss(user_id=None, language=language)
+    index = index or FileIndex.build(zip_output, base_files, solutions)
+    staged_bytes = uploaded_bytes = 0
+
+    def add(f: IndexedFile, add_file) -> None:
+        """Add the file, or its normalized copy under the original name, so folders still group submissions."""
+        nonlocal staged_bytes, uploaded_bytes
+        staged_bytes += f.size
+        if not normalizer:
+            uploaded_bytes += f.size
+            add_file(f.path)
+            return
+
+        copy = normalizer.normalized(f.path, language, hashes.digest(f) if hashes else None)
+        if copy:
+            uploaded_bytes += os.path.getsize(copy)
+            add_file(copy, display_name(f.path))
 
     files = []
-    submission_folders = []
+    # Files identical to a base file are never uploaded, nor are repeated copies if asked to collapse them
+    seen = set()
+    if hashes and base_files:
+        seen = {hashes.digest(f) for f in index.indexed_files(base_files, language)}
 
-    if max_submissions:
-        folders = glob.glob(f"{zip_output}/*", recursive=True)
-        random.shuffle(folders)
-        submission_folders = folders[:max_submissions]
-    else:
-        submission_folders = [zip_output]
+    if not submission_folders:
+        if max_submissions:
+            folders = index.submission_folders(zip_output).copy()
+            random.shuffle(folders)
+            submission_folders = folders[:max_submissions]
+        else:
+            submission_folders = [zip_output]
 
+    skipped = 0
     for folder in submission_folders:
-        files += list_files(folder, language)
+        for f in index.indexed_files(folder, language):
+            if hashes:
+                digest = hashes.digest(f)
+                if digest in seen:
+                    skipped += 1
+                    continue
+                if collapse_copies:
+                    seen.add(digest)
+            files.append(f)
+    if skipped:
+        log.debug(f"Skipped {skipped} file(s) identical to a base file or to a file already in the batch")
 
     for f in files:
-        moss.addFile(f)
+        add(f, moss.addFile)
 
-    if not files:
+    if not moss.files:
         raise FileNotFoundError("No files to upload. Checked the provided ZIP file and language")
 
     if base_files:
-        files = list_files(base_files, language)
+        files = index.indexed_files(base_files, language)
         if not files:
             raise FileNotFoundError(f"{base_files} returned no matches for base files")
         for f in files:
-            moss.addBaseFile(f)
+            add(f, moss.addBaseFile)
 
     if solutions:
-        files = list_files(solutions, language)
+        files = index.indexed_files(solutions, language)
         if not files:
             raise FileNotFoundError(f"{solutions} returned no matches for online solutions")
         for f in files:
-            moss.addFile(f)
+            add(f, moss.addFile)
+
+    if normalizer:
+        log.info(f"Normalized {staged_bytes} bytes to {uploaded_bytes} bytes for upload")
 
     moss.setCommentString(
         create_moss_comments(
@@ -168,32 +807,157 @@ def stage_moss_files(
     )
 
     moss.setDirectoryMode(1)
+    instrument.record(
+        "stage",
+        start,
+        time.perf_counter(),
+        time.thread_time() - start_cpu,
+        files=len(moss.files),
+        bytes=staged_bytes,
+        uploaded_bytes=uploaded_bytes,
+    )
     return moss
 
 
-def send_to_moss(moss: mosspy.Moss, report_path: str, user_id=None, no_report=False, count=1):
+def retry(func, *args, attempts=3, backoff=10.0, **kwargs):
+    """Call `func`, retrying with exponential backoff if it raises."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            log.warning(f"{func.__name__} failed ({e}), retrying in {delay:.0f}s ({attempt}/{attempts - 1})")
+            time.sleep(delay)
+
+
+def send_to_moss(
+    moss: "mosspy.Moss", report_path: str, user_id=None, no_report=False, count=1, attempts=3, journal: Journal = None
+):
+    """
+    Send the staged files to MOSS and save the report. If a `journal` is given, progress is recorded in it,
+    and steps the journal shows were already done for this batch are skipped.
+    """
+    journal = journal or Journal(path=None)
     moss.user_id = user_id or os.getenv("MOSS_ID") or MOSS_ID
 
     if not moss.user_id:
         raise ValueError("No MOSS ID found")
 
-    log.debug(f"Sending to MOSS with: {pprint.pformat(moss.__dict__)}")
-    url = moss.send(lambda file_path, _: log.debug(f"Uploading: {file_path}"))
-    log.info("Report URL: " + url)
+    def upload():
+        start, start_cpu = time.perf_counter(), time.thread_time()
+        sent = {"files": 0, "bytes": 0, "end": start}
 
-    log.info("Saving report page")
-    Path(report_path).mkdir(parents=True, exist_ok=True)
-    moss.saveWebPage(url, f"{report_path}/report{count}.html")
+        def on_send(file_path, _):
+            log.debug(f"Uploading: {file_path}")
+            sent["files"] += 1
+            sent["bytes"] += os.path.getsize(file_path)
+            sent["end"] = time.perf_counter()
 
-    if no_report:
+        url = moss.send(on_send)
+        # MOSS only replies once it has processed the files, after the last one is sent
+        cpu = time.thread_time() - start_cpu
+        instrument.record("upload", start, sent["end"], cpu, batch=count, files=sent["files"], bytes=sent["bytes"])
+        instrument.record("server_wait", sent["end"], time.perf_counter(), 0.0, batch=count)
+        if not url.startswith("http"):
+            raise ConnectionError(f"MOSS did not return a report URL: {url!r}")
+        return url
+
+    if journal.reached(count, "sent"):
+        url = journal.progress[str(count)]["url"]
+        log.info(f"Already sent, reusing report URL: {url}")
+    else:
+        log.debug(f"Sending to MOSS with: {pprint.pformat(moss.__dict__)}")
+        url = retry(upload, attempts=attempts)
+        log.info("Report URL: " + url)
+        journal.update(count, state="sent", url=url)
+
+    if not journal.reached(count, "saved"):
+        log.info("Saving report page")
+        Path(report_path).mkdir(parents=True, exist_ok=True)
+        with instrument.span("report_page", batch=count):
+            retry(moss.saveWebPage, url, f"{report_path}/report{count}.html", attempts=attempts)
+        journal.update(count, state="saved")
+
+    if no_report or journal.reached(count, "done"):
         return
 
+    import mosspy
+
     log.info("Downloading report")
     Path(f"{report_path}/report{count}").mkdir(parents=True, exist_ok=True)
-    mosspy.download_report(url, f"{report_path}/report{count}", connections=8, log_level=log.level)
+    with instrument.span("report_download", batch=count) as s:
+        retry(
+            mosspy.download_report,
+            url,
+            f"{report_path}/report{count}",
+            connections=8,
+            log_level=log.level,
+            attempts=attempts,
+        )
+        pages = [f.path for f in os.scandir(f"{report_path}/report{count}")]
+        s["files"] = len(pages)
+        s["bytes"] = sum(os.path.getsize(p) for p in pages)
+    journal.update(count, state="done")
+
+
+def next_batch(report_path: str) -> int:
+    """Number after the highest batch with a report saved in `report_path`, or 1 if there are none."""
+    if not os.path.isdir(report_path):
+        return 1
+    numbers = [int(res[1]) for name in os.listdir(report_path) if (res := re.fullmatch(r"report(\d+)(\.html)?", name))]
+    return max(numbers, default=0) + 1
+
+
+def send_batch(count: int, total: int, **kwargs) -> None:
+    """Send a staged batch to MOSS from a worker thread, labelling the thread so logs show the batch."""
+    threading.current_thread().name = f"Batch-{count}"
+    log.info(f"Sending batch {count}/{total} to MOSS")
+    send_to_moss(count=count, **kwargs)
+
+
+def score_locally(
+    moss: "mosspy.Moss", index: FileIndex, report_path: str, changed: set[str] = None
+) -> list[winnow.Match]:
+    """
+    Score the staged files with the local winnowing engine instead of MOSS.
+    Pairs are ranked by the percentage matched and saved to `local_report.json`.
+    If `changed` is given, only pairs with at least one of these submission folders are scored, and the pairs of the
+    other submissions are kept from the previous `local_report.json`.
+    """
+    # Normalized copies are staged under the name of the original file, which is used to group them
+    originals = {display_name(f.path): f.path for indexed in index.folders.values() for f in indexed}
+    sources = {originals[name]: path for path, name in moss.files + moss.base_files if name}
+    files = [originals[name] if name else path for path, name in moss.files]
+    base_files = [originals[name] if name else path for path, name in moss.base_files]
+
+    with instrument.span("fingerprint", files=len(files) + len(base_files)):
+        submissions = winnow.fingerprint(index.group(files), sources=sources)
+        base = winnow.fingerprint({"base": base_files}, sources=sources)[0]
+    with instrument.span("local_score", submissions=len(submissions)):
+        matches = winnow.compare(submissions, base, max_matches=moss.options["m"], focus=changed)
+
+    path = f"{report_path}/local_report.json"
+    if changed is not None and os.path.exists(path):
+        names = {s.name for s in submissions}
+        with open(path) as f:
+            previous = [winnow.Match(**m) for m in json.load(f)]
+        # Pairs of submissions that were removed or scored again are left out
+        kept = [m for m in previous if {m.first, m.second} <= names and not {m.first, m.second} & changed]
+        matches = sorted(matches + kept, key=lambda m: (max(m.first_percent, m.second_percent), m.shared), reverse=True)
+
+    Path(report_path).mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump([asdict(m) for m in matches], f, indent=2)
+
+    for m in matches[:10]:
+        log.info(f"{m.first} ({m.first_percent}%) - {m.second} ({m.second_percent}%): {m.shared} fingerprints")
+    log.info(f"Saved {len(matches)} pair(s) to {report_path}/local_report.json")
+    return matches
 
 
-def parse_args():
+def parse_args(args: list[str] = None):
     parser = argparse.ArgumentParser(description="Utility for unzipping Canvas submission and uploading files to MOSS.")
 
     parser.add_argument("zip_file", help="The submission ZIP file from Canvas.")
@@ -206,6 +970,66 @@ def parse_args():
         help="Do not save MOSS report to local machine.",
         action="store_true",
     )
+    parser.add_argument(
+        "--resume",
+        help="""
+        Continue an interrupted run from where it stopped, reusing the extracted submissions and the batches already
+        sent or downloaded. Progress is recorded in a journal next to the extraction folder.
+        """,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--incremental",
+        help="""
+        Extract into an existing output folder, only extracting submissions that are new or changed since the
+        last run. Only pairs involving those submissions are compared.
+        """,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--local",
+        help="Score submissions locally with winnowing instead of sending them to MOSS. Works offline.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--collapse-copies",
+        help="""
+        Upload only one copy of files that are byte-for-byte identical within a batch.
+        Identical files are always listed in `exact_copies.json` in the report folder.
+        """,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--source-only",
+        help="Only extract source files for the assignment's language.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--all-attempts",
+        help="Extract every attempt of resubmitted assignments, instead of only the latest one.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--latest-by",
+        help="Find the latest attempt by the time in the Canvas ZIP file, or by the '-i' suffix of resubmissions.",
+        choices=["time", "suffix"],
+        default="time",
+    )
+    parser.add_argument(
+        "--normalize",
+        help="""
+        Upload copies of the files with comments and extra whitespace removed, keeping line numbers.
+        Copies are cached next to the ZIP output folder.
+        """,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-file-kb",
+        metavar="n",
+        help="With --normalize, maximum size of each uploaded file in KiB. Lines past the limit are dropped.",
+        type=int,
+        default=100,
+    )
     parser.add_argument(
         "--original-name",
         help="""
@@ -220,6 +1044,16 @@ def parse_args():
         action="store_true",
     )
 
+    parser.add_argument(
+        "--profile",
+        metavar="path",
+        help="Save the time spent in each stage as a Chrome trace (JSON), with a summary of each stage.",
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="path",
+        help="With --profile, also save a cProfile capture of the run.",
+    )
     parser.add_argument(
         "-n",
         "--max-submissions",
@@ -228,14 +1062,74 @@ def parse_args():
         type=int,
         default=0,
     )
+    parser.add_argument(
+        "--weighted",
+        help="Weight batch planning by the size of each submission, favouring batches with less to upload.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-batch-mb",
+        metavar="n",
+        help="Maximum size of the files uploaded per batch, in MiB, including base files and solutions.",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--max-batch-files",
+        metavar="n",
+        help="Maximum number of files uploaded per batch, including base files and solutions.",
+        type=int,
+        default=0,
+    )
     parser.add_argument(
         "-r",
         "--repeat",
         metavar="n",
-        help="Number of times to perform repeated submissions.",
+        help="""
+        Number of times to perform repeated submissions.
+        Ignored when a maximum number of submissions is set, as the number of batches needed to
+        compare every pair of submissions is then computed instead.
+        """,
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="n",
+        help="Number of worker processes used to extract submissions.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        metavar="n",
+        help="Number of batches to keep in flight with MOSS at once.",
         type=int,
         default=1,
     )
+    parser.add_argument(
+        "--retries",
+        metavar="n",
+        help="Number of times to retry a failed upload or report download, with exponential backoff.",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--max-student-mb",
+        metavar="n",
+        help="Maximum size of files extracted per student, in MiB. Files past the limit are skipped.",
+        type=int,
+        default=50,
+    )
+    parser.add_argument(
+        "--max-student-files",
+        metavar="n",
+        help="Maximum number of files extracted per student. Files past the limit are skipped.",
+        type=int,
+        default=2000,
+    )
     parser.add_argument(
         "-o",
         "--zip-output",
@@ -281,8 +1175,29 @@ def parse_args():
         """,
         type=int,
     )
+    parser.add_argument(
+        "--corpus",
+        metavar="path",
+        help="Check each submission against a corpus of fingerprints from past terms and known solutions.",
+    )
+    parser.add_argument(
+        "--add-to-corpus",
+        metavar="term",
+        help="""
+        Add this term's submissions, and the solutions, to the corpus after checking them. Submissions are not
+        checked against the term's own documents, and rerunning only replaces the submissions that changed.
+        """,
+    )
+    parser.add_argument(
+        "--moss-server",
+        metavar="host:port",
+        help="Submit to another MOSS server, such as the local stand-in in moss_server.py.",
+    )
 
-    return parser.parse_args()
+    opt = parser.parse_args(args)
+    if opt.max_submissions and opt.max_submissions < 2:
+        parser.error("--max-submissions must be at least 2, or 0 for no limit")
+    return opt
 
 
 def setup_logger():
@@ -301,32 +1216,187 @@ def main():
     log.setLevel(logging.DEBUG if opt.verbose else logging.INFO)
     log.debug(f"CLI options: {pprint.pformat(opt.__dict__)}")
 
-    unzip_canvas_submission(
-        canvas_zip=opt.zip_file,
-        zip_output=opt.zip_output,
-        original_name=opt.original_name,
-    )
+    if opt.profile:
+        instrument.enable(cprofile=bool(opt.cprofile))
+    try:
+        run(opt)
+    finally:
+        if opt.profile:
+            instrument.dump(opt.profile, opt.cprofile)
+            log.info(f"Saved profile to {opt.profile}")
+
+
+def run(opt: argparse.Namespace, pool: Executor = None):
+    """
+    Run the pipeline with the parsed CLI options.
+    Pass a process `pool` to extract with, to share it with other work, such as other runs.
+    """
+    # Only options that change what is extracted or sent need to match for a run to be resumed
+    resumable = {k: v for k, v in vars(opt).items() if k not in RESUME_IGNORED_OPTIONS}
+    journal = Journal.start(opt.zip_output, resumable, resume=opt.resume)
+
+    if journal.extracted is not None:
+        extracted = journal.extracted
+        log.info(f"Reusing {len(extracted)} extracted submission(s)")
+    else:
+        extracted, _ = unzip_canvas_submission(
+            canvas_zip=opt.zip_file,
+            zip_output=opt.zip_output,
+            original_name=opt.original_name,
+            jobs=opt.jobs,
+            # An interrupted extraction is picked up where it stopped
+            incremental=opt.incremental or opt.resume,
+            all_attempts=opt.all_attempts,
+            latest_by=opt.latest_by,
+            executor=pool,
+            policy=ExtractPolicy(
+                extensions=tuple(LANGUAGE_EXTENSIONS.get(opt.language.lower(), [])) if opt.source_only else (),
+                max_bytes=opt.max_student_mb * 2**20,
+                max_files=opt.max_student_files,
+            ),
+        )
+        journal.extracted = extracted
+        journal.save()
 
     if opt.extract_only:
         log.info("Extract only mode. Stopping.")
         return
 
-    for n in range(1, opt.repeat + 1):
-        log.info(f"Sending batch {n}/{opt.repeat} to MOSS")
+    # In incremental mode, only pairs involving a new or changed submission are compared
+    changed = {os.path.join(opt.zip_output, f) for f in extracted} if opt.incremental else None
+    if changed is not None and not changed:
+        log.info("No new or changed submissions. Stopping.")
+        return
+
+    with instrument.span("index") as s:
+        index = FileIndex.build(opt.zip_output, opt.base_files, opt.solutions)
+        s["files"] = sum(len(files) for files in index.folders.values())
+    log.debug(f"Indexed {s['files']} files")
+
+    with instrument.span("hash"):
+        hashes = HashStore.load(opt.zip_output)
+        copies = find_exact_copies(index, opt.zip_output, opt.language, hashes, opt.base_files)
+        hashes.save()
+    for paths in copies.values():
+        log.warning(f"Identical files: {', '.join(paths)}")
+    Path(opt.report_output).mkdir(parents=True, exist_ok=True)
+    with open(f"{opt.report_output}/exact_copies.json", "w") as f:
+        json.dump(copies, f, indent=2)
+
+    if opt.corpus:
+        with instrument.span("corpus") as s, Corpus(opt.corpus) as corpus:
+            past = check_corpus(
+                corpus, index, opt.zip_output, opt.language, opt.base_files, opt.add_to_corpus, opt.solutions
+            )
+            s["documents"] = len(corpus.documents)
+        for name, matches in past.items():
+            for m in matches[:1]:
+                log.info(f"{name} ({m['first_percent']}%) - {m['second']} ({m['second_percent']}%) in corpus")
+        with open(f"{opt.report_output}/corpus_matches.json", "w") as f:
+            json.dump(past, f, indent=2)
+
+    normalizer = None
+    if opt.normalize:
+        normalizer = Normalizer(os.path.normpath(opt.zip_output) + ".normalized", max_bytes=opt.max_file_kb * 2**10)
+
+    if opt.local:
         moss = stage_moss_files(
             zip_output=opt.zip_output,
             language=opt.language,
-            max_submissions=opt.max_submissions,
             base_files=opt.base_files,
             solutions=opt.solutions,
+            index=index,
+            hashes=hashes,
+            collapse_copies=opt.collapse_copies,
+            normalizer=normalizer,
         )
-        send_to_moss(
-            moss=moss,
-            report_path=opt.report_output,
-            user_id=opt.moss_id,
-            no_report=opt.no_report,
-            count=n,
-        )
+        score_locally(moss=moss, index=index, report_path=opt.report_output, changed=changed)
+        return
+
+    if opt.max_submissions or opt.max_batch_mb or opt.max_batch_files:
+        folders = index.submission_folders(opt.zip_output)
+        sizes = {}
+        for f in folders:
+            files = index.indexed_files(f, opt.language)
+            sizes[f] = (sum(i.size for i in files), len(files))
+        weights = {f: size for f, (size, _) in sizes.items()} if opt.weighted else None
+
+        # Base files and solutions are sent with every batch, so they take up part of the budget of each
+        shared = [
+            i for root in (opt.base_files, opt.solutions) if root for i in index.indexed_files(root, opt.language)
+        ]
+        max_bytes = max(opt.max_batch_mb * 2**20 - sum(i.size for i in shared), 1) if opt.max_batch_mb else 0
+        max_files = max(opt.max_batch_files - len(shared), 1) if opt.max_batch_files else 0
+        alone, pairs = oversized(folders, sizes, max_bytes, max_files)
+        for f in alone:
+            log.warning(f"{f} is too large for any batch ({sizes[f][0] / 2**20:.1f} MiB, {sizes[f][1]} files)")
+        if pairs:
+            log.warning(f"{pairs} pair(s) of submissions are too large to be compared in one batch")
+
+        batches = plan_batches(folders, opt.max_submissions, weights, changed, sizes, max_bytes, max_files)
+        log.info(f"Planned {len(batches)} batch(es) to compare every pair of {len(folders)} submissions")
+    else:
+        batches = [None] * opt.repeat
+
+    if journal.batches is not None:
+        batches = journal.batches
+        numbers = range(journal.first_batch, journal.first_batch + len(batches))
+        done = sum(journal.reached(n, "saved" if opt.no_report else "done") for n in numbers)
+        log.info(f"Resuming {len(batches) - done} of {len(batches)} batch(es)")
+    elif opt.incremental:
+        # Numbered after the reports of earlier runs, which still hold the pairs of unchanged submissions
+        journal.first_batch = next_batch(opt.report_output)
+    journal.batches = batches
+    journal.save()
+
+    failures = {}
+    with ThreadPoolExecutor(max_workers=opt.concurrency) as executor:
+        futures = {}
+        for n, batch in enumerate(batches, start=journal.first_batch):
+            log.debug(f"Staging batch {n}/{journal.first_batch + len(batches) - 1}")
+            moss = stage_moss_files(
+                zip_output=opt.zip_output,
+                language=opt.language,
+                max_submissions=opt.max_submissions,
+                base_files=opt.base_files,
+                solutions=opt.solutions,
+                index=index,
+                submission_folders=batch,
+                hashes=hashes,
+                collapse_copies=opt.collapse_copies,
+                normalizer=normalizer,
+            )
+            if opt.moss_server:
+                host, _, port = opt.moss_server.rpartition(":")
+                moss.server, moss.port = host, int(port)
+            future = executor.submit(
+                send_batch,
+                count=n,
+                total=journal.first_batch + len(batches) - 1,
+                moss=moss,
+                report_path=opt.report_output,
+                user_id=opt.moss_id,
+                no_report=opt.no_report,
+                attempts=opt.retries + 1,
+                journal=journal,
+            )
+            futures[future] = n
+
+        from report_index import ReportIndex
+
+        # Reports are indexed as their batch finishes, so the index can be queried while a long run is going
+        with ReportIndex(f"{opt.report_output}/index.sqlite", opt.zip_output) as reports:
+            for future in as_completed(futures):
+                n = futures[future]
+                try:
+                    future.result()
+                    reports.ingest_report(f"{opt.report_output}/report{n}.html", n)
+                except Exception as e:
+                    failures[n] = f"{type(e).__name__}: {e}"
+
+    for n in sorted(failures):
+        log.error(f"Batch {n} failed: {failures[n]}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,251 @@
+"""
+Local stand-in for the MOSS server, to test and benchmark the submit path without a network.
+
+Speaks the socket protocol `mosspy.Moss.send` uses, scores each query with the local winnowing engine, and serves
+report pages in the format `Moss.saveWebPage` and `mosspy.download_report` expect. Processing latency and failures
+can be injected, and the bytes, files and queries received are counted.
+
+    python moss_server.py --port 7690 --latency 5 --failure-rate 0.1
+
+Then point `mos_moss` to it with `--moss-server localhost:7690`.
+"""
+
+import argparse
+import html
+import json
+import os
+import random
+import socketserver
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import winnow
+
+
+class MossProtocolHandler(socketserver.StreamRequestHandler):
+    server: "MossServer._SocketServer"
+
+    def handle(self):
+        moss = self.server.moss
+        start = time.perf_counter()
+        options = {}
+        files: list[tuple[int, str, str]] = []
+        received = 0
+
+        try:
+            while line := self.rfile.readline():
+                command, _, args = line.decode(errors="replace").rstrip("\n").partition(" ")
+                if command == "file":
+                    file_id, _, size, name = args.split(" ", 3)
+                    data = self.rfile.read(int(size))
+                    received += len(data)
+                    files.append((int(file_id), name, data.decode(errors="replace")))
+                elif command == "language":
+                    options["l"] = args
+                    self.wfile.write(b"yes\n")
+                elif command == "query":
+                    options["c"] = args.partition(" ")[2]
+                    time.sleep(moss.latency)
+                    moss.count(files=len(files), bytes=received, queries=1)
+                    if moss.fail():
+                        return
+                    url = moss.add_report(files, options)
+                    self.wfile.write(f"{url}\n".encode())
+                elif command == "end":
+                    break
+                else:
+                    options[command] = args
+        finally:
+            moss.count(seconds=time.perf_counter() - start)
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    server: "MossServer._HTTPServer"
+
+    def do_GET(self):
+        moss = self.server.moss
+        if self.path == "/stats":
+            return self.respond(json.dumps(moss.stats).encode(), "application/json")
+
+        parts = self.path.strip("/").split("/")
+        page = None
+        if len(parts) >= 2 and parts[0] == "results" and parts[1] in moss.reports:
+            page = moss.reports[parts[1]].get(parts[2] if len(parts) > 2 else "index.html")
+        if page is None:
+            return self.send_error(404)
+        if moss.fail():
+            return self.send_error(500)
+        moss.count(pages=1)
+        self.respond(page.encode(), "text/html; charset=utf-8")
+
+    def respond(self, body: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MossServer:
+    """
+    MOSS stand-in listening for submissions on `port`, and serving reports over HTTP on `http_port`.
+    Use a port of 0 to pick a free port. Can be used as a context manager, which serves from background threads.
+
+    :param latency: Seconds to wait before replying to a query, like the time MOSS takes to process a submission.
+    :param failure_rate: Chance of dropping a query without a report URL, or failing to serve a report page.
+    """
+
+    class _SocketServer(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+        moss: "MossServer"
+
+    class _HTTPServer(ThreadingHTTPServer):
+        daemon_threads = True
+        moss: "MossServer"
+
+    def __init__(self, host="127.0.0.1", port=0, http_port=0, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.reports: dict[str, dict[str, str]] = {}
+        self.stats = {"queries": 0, "files": 0, "bytes": 0, "pages": 0, "failures": 0, "seconds": 0.0}
+        self.lock = threading.Lock()
+
+        self.socket_server = self._SocketServer((host, port), MossProtocolHandler)
+        self.http_server = self._HTTPServer((host, http_port), ReportHandler)
+        self.socket_server.moss = self.http_server.moss = self
+        self.host = host
+        self.port = self.socket_server.server_address[1]
+        self.http_port = self.http_server.server_address[1]
+        self.threads = []
+
+    def __enter__(self) -> "MossServer":
+        for server in (self.socket_server, self.http_server):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for server in (self.socket_server, self.http_server):
+            server.shutdown()
+            server.server_close()
+
+    def count(self, **counts) -> None:
+        with self.lock:
+            for k, v in counts.items():
+                self.stats[k] += v
+
+    def fail(self) -> bool:
+        with self.lock:
+            failed = self.random.random() < self.failure_rate
+            self.stats["failures"] += failed
+        return failed
+
+    def add_report(self, files: list[tuple[int, str, str]], options: dict[str, str]) -> str:
+        """Score the submission locally and store its report pages. Returns the report URL."""
+        directory_mode = options.get("directory") == "1"
+        base = winnow.Fingerprints("base")
+        submissions: dict[str, winnow.Fingerprints] = {}
+        for file_id, name, text in files:
+            if file_id == 0:
+                base.add_text(name, text)
+                continue
+            submission = os.path.dirname(name) + "/" if directory_mode else name
+            submissions.setdefault(submission, winnow.Fingerprints(submission)).add_text(name, text)
+
+        matches = winnow.compare(
+            list(submissions.values()),
+            base,
+            max_matches=int(options.get("maxmatches", 10)),
+            top=int(options.get("show", 250)),
+        )
+
+        with self.lock:
+            report_id = str(len(self.reports) + 1)
+            url = f"http://{self.host}:{self.http_port}/results/{report_id}"
+            self.reports[report_id] = report_pages(url, matches, {name: text for _, name, text in files}, options)
+        return url
+
+
+def report_pages(url: str, matches: list[winnow.Match], texts: dict[str, str], options: dict[str, str]) -> dict:
+    """Build the index and match pages of a report, following the layout of MOSS' pages."""
+    rows = []
+    pages = {}
+    for i, m in enumerate(matches):
+        lines = sum(end - start + 1 for _, start, end in m.first_lines)
+        rows.append(
+            f'<TR><TD><A HREF="{url}/match{i}.html">{html.escape(m.first)} ({m.first_percent}%)</A>\n'
+            f'    <TD><A HREF="{url}/match{i}.html">{html.escape(m.second)} ({m.second_percent}%)</A>\n'
+            f"<TD ALIGN=right>{lines}\n"
+        )
+        pages[f"match{i}.html"] = (
+            f"<HTML><HEAD><TITLE>Matches for {html.escape(m.first)} and {html.escape(m.second)}</TITLE></HEAD>\n"
+            f'<FRAMESET ROWS="150,*"><FRAME SRC="match{i}-top.html" NAME="top">\n'
+            f'<FRAMESET COLS="50%,50%"><FRAME SRC="match{i}-0.html" NAME="0">'
+            f'<FRAME SRC="match{i}-1.html" NAME="1"></FRAMESET></FRAMESET></HTML>\n'
+        )
+        top = "".join(
+            f"<TR><TD>{html.escape(a[0])} {a[1]}-{a[2]}<TD>{html.escape(b[0])} {b[1]}-{b[2]}\n"
+            for a, b in zip(m.first_lines, m.second_lines)
+        )
+        pages[f"match{i}-top.html"] = f"<HTML><BODY><TABLE BORDER=1>\n{top}</TABLE></BODY></HTML>\n"
+        for side, ranges in enumerate((m.first_lines, m.second_lines)):
+            body = "".join(
+                f"<HR><H3>{html.escape(name)} {start}-{end}</H3><PRE>"
+                f"{html.escape(chr(10).join(texts.get(name, '').splitlines()[start - 1 : end]))}</PRE>\n"
+                for name, start, end in ranges
+            )
+            pages[f"match{i}-{side}.html"] = f"<HTML><BODY BGCOLOR=white>\n{body}</BODY></HTML>\n"
+
+    pages["index.html"] = (
+        "<HTML><HEAD><TITLE>Moss Results</TITLE></HEAD><BODY>\n"
+        f"Moss Results<p>\n{datetime.now():%a %b %d %H:%M:%S %Z%Y}\n<p>\n"
+        f"Options -l {html.escape(options.get('l', 'c'))} -d {options.get('directory', '0')} "
+        f"-m {options.get('maxmatches', '10')}\n<HR>\n{options.get('c', '')}<P>\n"
+        "<TABLE>\n<TR><TH>File 1<TH>File 2<TH>Lines Matched\n"
+        f"{''.join(rows)}</TABLE>\n<HR>\nAny errors encountered during this query are listed below.<p></BODY></HTML>\n"
+    )
+    return pages
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local stand-in for the MOSS server.")
+
+    parser.add_argument("--host", help="Address to listen on.", default="127.0.0.1")
+    parser.add_argument("--port", help="Port for submissions.", type=int, default=7690)
+    parser.add_argument("--http-port", help="Port for report pages.", type=int, default=8080)
+    parser.add_argument(
+        "--latency", metavar="seconds", help="Time to wait before replying to a query.", type=float, default=0.0
+    )
+    parser.add_argument(
+        "--failure-rate",
+        metavar="fraction",
+        help="Chance of dropping a query or failing to serve a page.",
+        type=float,
+        default=0.0,
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    opt = parse_args()
+    with MossServer(opt.host, opt.port, opt.http_port, latency=opt.latency, failure_rate=opt.failure_rate) as server:
+        print(f"Listening on {server.host}:{server.port}, serving reports on port {server.http_port}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        print(json.dumps(server.stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
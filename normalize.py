@@ -0,0 +1,83 @@
+"""
+Normalized copies of source files, with comments and extra whitespace removed, to cut down what is uploaded.
+
+Line breaks are kept, so line numbers in the reports still match the student's files. Copies are cached by the
+SHA-256 of the original content, so repeated batches and reruns reuse them.
+"""
+
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+
+from files import atomic_write
+
+# Comments, and the string and character literals that may contain comment markers
+C_LIKE = re.compile(r"//[^\n]*|/\*.*?\*/|\"(?:\\.|[^\"\\\n])*\"|'(?:\\.|[^'\\\n])*'", re.DOTALL)
+
+COMMENTS: dict[str, re.Pattern] = {
+    "java": C_LIKE,
+    "cpp": C_LIKE,
+}
+
+# Bump when the normalization changes, so cached copies are not reused
+VERSION = 1
+
+
+def strip_comments(text: str, language: str) -> str:
+    """Remove comments, keeping the line breaks inside them."""
+    pattern = COMMENTS.get(language.lower())
+    if not pattern:
+        return text
+
+    def replace(res: re.Match) -> str:
+        token = res[0]
+        return "\n" * token.count("\n") if token.startswith("/") else token
+
+    return pattern.sub(replace, text)
+
+
+def normalize(text: str, language: str, max_bytes=0) -> str:
+    """
+    Strip comments, indentation and repeated whitespace. If `max_bytes` is set, lines past the limit are dropped.
+    Returns an empty string if nothing but comments and whitespace is left.
+    """
+    lines = [" ".join(line.split()) for line in strip_comments(text, language).splitlines()]
+    text = "\n".join(lines).rstrip() + "\n"
+
+    if max_bytes and len(text.encode()) > max_bytes:
+        text = text.encode()[:max_bytes].decode(errors="ignore")
+        text = text[: text.rfind("\n") + 1]
+    return text if text.strip() else ""
+
+
+@dataclass
+class Normalizer:
+    """
+    Writes normalized copies of files into `cache_dir`, named after the SHA-256 of their original content.
+
+    :param cache_dir: Folder to keep the normalized copies in.
+    :param max_bytes: Maximum size of a normalized copy. Set to 0 for no limit.
+    """
+
+    cache_dir: str
+    max_bytes: int = 100 * 2**10
+
+    def normalized(self, path: str, language: str, digest: str = None) -> str | None:
+        """
+        Path to the normalized copy of the file, or `None` if nothing is left after normalizing.
+        Pass the SHA-256 of the file as `digest` if it is already known.
+        """
+        if not digest:
+            with open(path, "rb") as f:
+                digest = hashlib.file_digest(f, "sha256").hexdigest()
+
+        copy = os.path.join(self.cache_dir, f"{digest}-{language}-{self.max_bytes}-v{VERSION}.txt")
+        if not os.path.exists(copy):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                text = normalize(f.read(), language, self.max_bytes)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with atomic_write(copy, encoding="utf-8") as f:
+                f.write(text)
+
+        return copy if os.path.getsize(copy) else None
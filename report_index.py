@@ -0,0 +1,270 @@
+"""
+Index of the pairs found in saved MOSS reports, stored in SQLite so they can be queried across batches.
+
+Each `report{n}.html` saved by `mos_moss` is parsed line by line, and each pair is keyed by the submission folders of
+both sides. A pair found in several batches keeps its highest match. Reports already ingested are skipped unless they
+changed, so the index can be updated as new batches arrive:
+
+    python report_index.py report -o zip_output --top 20
+    python report_index.py report -o zip_output --student "doejohn_*"
+"""
+
+import argparse
+import html
+import json
+import os
+import posixpath
+import re
+import sqlite3
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+REPORT_NAME = re.compile(r"report(\d+)\.html")
+# A side of a pair in the report, such as: <A HREF="http://moss.stanford.edu/results/1/2/match0.html">path (42%)</A>
+SIDE = re.compile(r'<A HREF="([^"]*)">(.*) \((\d+)%\)</A>', re.IGNORECASE)
+LINES = re.compile(r"<TD ALIGN=right>(\d+)", re.IGNORECASE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    path TEXT PRIMARY KEY,
+    batch INTEGER,
+    size INTEGER,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS matches (
+    report TEXT,
+    batch INTEGER,
+    first TEXT,
+    second TEXT,
+    first_percent INTEGER,
+    second_percent INTEGER,
+    percent INTEGER,
+    lines INTEGER,
+    url TEXT,
+    PRIMARY KEY (report, first, second)
+);
+CREATE TABLE IF NOT EXISTS pairs (
+    first TEXT,
+    second TEXT,
+    first_percent INTEGER,
+    second_percent INTEGER,
+    percent INTEGER,
+    lines INTEGER,
+    batch INTEGER,
+    url TEXT,
+    PRIMARY KEY (first, second)
+);
+CREATE INDEX IF NOT EXISTS pairs_second ON pairs (second);
+CREATE INDEX IF NOT EXISTS pairs_rank ON pairs (percent DESC, lines DESC);
+"""
+
+
+@dataclass
+class ReportRow:
+    """One row of a MOSS report: the two files or folders matched, and how much of each matched."""
+
+    first: str
+    second: str
+    first_percent: int
+    second_percent: int
+    lines: int
+    url: str
+
+
+def parse_report(path: str) -> Iterator[ReportRow]:
+    """Parse the rows of a saved MOSS report page, one line at a time."""
+    sides = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if res := SIDE.search(line):
+                sides.append(res)
+            elif (res := LINES.search(line)) and len(sides) >= 2:
+                first, second = sides[-2:]
+                yield ReportRow(
+                    first=html.unescape(first[2]),
+                    second=html.unescape(second[2]),
+                    first_percent=int(first[3]),
+                    second_percent=int(second[3]),
+                    lines=int(res[1]),
+                    url=first[1],
+                )
+                sides = []
+
+
+def submission(name: str, root: str = "") -> str:
+    """
+    Submission folder a file or folder in a report belongs to: the first folder under `root`, or the first folder
+    of the path if it is not under `root`.
+    """
+    # Normalized, so "./zip_output" and "/tmp/zip_output/" match the paths the way MOSS prints them
+    name = posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+    root = posixpath.normpath(root.replace("\\", "/").replace(" ", "_")).lstrip("/") if root else ""
+    if root not in ("", ".") and name.startswith(root + "/"):
+        name = name[len(root) + 1 :]
+    return name.split("/")[0]
+
+
+class ReportIndex:
+    """
+    SQLite index of the pairs in saved MOSS reports.
+
+    :param path: Path of the SQLite database. Created if it does not exist.
+    :param root: Folder the submissions were extracted into, which is stripped from the paths in the reports to find
+        the submission folders.
+    """
+
+    def __init__(self, path: str, root: str = ""):
+        self.path = path
+        self.root = root
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self) -> "ReportIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def ingest(self, report_path: str) -> int:
+        """Ingest every `report{n}.html` in the folder that is new or changed. Returns the number ingested."""
+        ingested = 0
+        for entry in sorted(os.scandir(report_path), key=lambda e: e.name):
+            if res := REPORT_NAME.fullmatch(entry.name):
+                ingested += self.ingest_report(entry.path, int(res[1]))
+        return ingested
+
+    def ingest_report(self, path: str, batch: int) -> bool:
+        """Ingest one report page, unless it was already ingested and has not changed since."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        seen = self.db.execute("SELECT size, mtime FROM reports WHERE path = ?", (path,)).fetchone()
+        if seen and (seen["size"], seen["mtime"]) == (stat.st_size, stat.st_mtime):
+            return False
+
+        rows = []
+        for row in parse_report(path):
+            first, second = submission(row.first, self.root), submission(row.second, self.root)
+            # Folders of the same submission can match each other, but that is not a pair of students
+            if first == second:
+                continue
+            if first > second:
+                first, second = second, first
+                row.first_percent, row.second_percent = row.second_percent, row.first_percent
+            percent = max(row.first_percent, row.second_percent)
+            rows.append(
+                (path, batch, first, second, row.first_percent, row.second_percent, percent, row.lines, row.url)
+            )
+
+        with self.db:
+            touched = self.db.execute("SELECT first, second FROM matches WHERE report = ?", (path,)).fetchall()
+            self.db.execute("DELETE FROM matches WHERE report = ?", (path,))
+            # A pair can appear once per folder of the submissions, so keep the best row of each report
+            self.db.executemany(
+                """
+                INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (report, first, second) DO UPDATE SET
+                    first_percent = excluded.first_percent,
+                    second_percent = excluded.second_percent,
+                    percent = excluded.percent,
+                    lines = excluded.lines,
+                    url = excluded.url
+                WHERE (excluded.percent, excluded.lines) > (percent, lines)
+                """,
+                rows,
+            )
+            self.update_pairs({(r[0], r[1]) for r in touched} | {(r[2], r[3]) for r in rows})
+            self.db.execute(
+                "INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?)", (path, batch, stat.st_size, stat.st_mtime)
+            )
+        return True
+
+    def update_pairs(self, pairs: set[tuple[str, str]]) -> None:
+        """Recompute the best match of each of the pairs across all ingested reports."""
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS touched (first TEXT, second TEXT)")
+        self.db.execute("DELETE FROM touched")
+        self.db.executemany("INSERT INTO touched VALUES (?, ?)", pairs)
+        self.db.execute("DELETE FROM pairs WHERE (first, second) IN (SELECT first, second FROM touched)")
+        self.db.execute("""
+            INSERT INTO pairs
+            SELECT first, second, first_percent, second_percent, percent, lines, batch, url FROM (
+                SELECT *, row_number() OVER (
+                    PARTITION BY first, second ORDER BY percent DESC, lines DESC, batch
+                ) AS rank
+                FROM matches WHERE (first, second) IN (SELECT first, second FROM touched)
+            )
+            WHERE rank = 1
+            """)
+
+    def top(self, n=20) -> list[dict]:
+        """The `n` pairs with the highest match."""
+        rows = self.db.execute("SELECT * FROM pairs ORDER BY percent DESC, lines DESC LIMIT ?", (n,))
+        return [dict(row) for row in rows]
+
+    def matched_with(self, student: str) -> list[dict]:
+        """
+        Every pair involving the submission folder, best match first. Wildcards can be used, as in
+        "doejohn_*", to match on part of the folder name.
+        """
+        rows = self.db.execute(
+            """
+            SELECT * FROM pairs WHERE first GLOB :student
+            UNION
+            SELECT * FROM pairs WHERE second GLOB :student
+            ORDER BY percent DESC, lines DESC
+            """,
+            {"student": student},
+        )
+        return [dict(row) for row in rows]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Index saved MOSS reports in SQLite, and query the pairs found.")
+
+    parser.add_argument("report_output", help="Folder the MOSS reports were saved to.")
+    parser.add_argument(
+        "-d",
+        "--database",
+        metavar="path",
+        help="Path of the SQLite database. Defaults to index.sqlite in the report folder.",
+    )
+    parser.add_argument(
+        "-o",
+        "--zip-output",
+        metavar="path",
+        help="Folder the submissions were extracted into, to find the submission folder of each file.",
+        default="",
+    )
+    parser.add_argument("--top", metavar="n", help="Show the n pairs with the highest match.", type=int, default=20)
+    parser.add_argument(
+        "--student", metavar="folder", help="Show every pair involving the submission folder. Wildcards can be used."
+    )
+    parser.add_argument("--json", help="Print the pairs as JSON.", action="store_true")
+
+    return parser.parse_args()
+
+
+def main():
+    opt = parse_args()
+
+    with ReportIndex(opt.database or os.path.join(opt.report_output, "index.sqlite"), opt.zip_output) as index:
+        ingested = index.ingest(opt.report_output)
+        print(f"Ingested {ingested} new or changed report(s)")
+
+        pairs = index.matched_with(opt.student) if opt.student else index.top(opt.top)
+
+    if opt.json:
+        print(json.dumps(pairs, indent=2))
+        return
+    for p in pairs:
+        print(
+            f"{p['first']} ({p['first_percent']}%) - {p['second']} ({p['second_percent']}%): "
+            f"{p['lines']} lines, batch {p['batch']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+r"""
+Compliance rules for submissions, such as the folders, report and files each one needs.
+
+Rules are given per course in a JSON file, where each pattern is a regular expression searched for in the paths of a
+submission, or matched against the name of its ZIP file:
+
+    {
+        "zip_name": "\\w+-Assignment-\\w+(-\\d)?\\.zip",
+        "report": "(?i:assignment.+report).*\\.pdf$",
+        "folders": ["A", "B"],
+        "required": {"a Makefile": "(^|/)Makefile$"},
+        "forbidden": {"compiled files": "\\.(o|out|exe|class)$"}
+    }
+
+`folders` is either a list of parts, each needing a folder named like "Part_A", or a mapping of names to patterns.
+Set `zip_name` or `report` to null to skip that check. Keys left out fall back to the default checks. Use scoped flags
+like `(?i:...)` instead of global ones, as the patterns of a submission's paths are combined into a single expression.
+"""
+
+import json
+import re
+from dataclasses import dataclass
+
+KINDS = ("zip_name", "folder", "report", "required", "forbidden")
+
+ZIP_NAME = r"\w+-Assignment-\w+(-\d)?\.zip"
+REPORT = r"(?i:assignment.+report).*\.pdf$"
+
+
+def folder_pattern(part: str) -> str:
+    """Per policy, solutions go in folders in the form "Part_X", ignoring case and punctuations."""
+    return rf"(?i:part.*{part}/)"
+
+
+def is_hidden(path: str) -> bool:
+    """Whether any part of the path is hidden. Hidden items are skipped by most checks, like `glob` does."""
+    return path.startswith(".") or "/." in path
+
+
+@dataclass
+class Rule:
+    """
+    A single check of a submission.
+
+    - `zip_name`: the ZIP file name must match, with underscores read as dashes.
+    - `folder`: a folder must match. Hidden folders are skipped.
+    - `report`: a file must match. Hidden files are skipped.
+    - `required`: a file or folder must match. Hidden items are skipped.
+    - `forbidden`: no file or folder may match, including hidden ones.
+    """
+
+    kind: str
+    name: str
+    pattern: str
+
+    def applies(self, is_dir: bool, hidden: bool) -> bool:
+        if self.kind == "forbidden":
+            return True
+        if hidden:
+            return False
+        if self.kind == "folder":
+            return is_dir
+        if self.kind == "report":
+            return not is_dir
+        return True
+
+
+class RuleSet:
+    """
+    Rules compiled once, for checking many submissions.
+
+    Paths are split into folders, files and hidden items, and the rules that apply to each are combined into a single
+    expression. Most paths match none of the rules, and are passed over with that one search. Only paths that match it
+    are checked against the rules left to satisfy, and the pass stops early once no path can change the result.
+    """
+
+    def __init__(self, rules: list[Rule]):
+        for rule in rules:
+            if rule.kind not in KINDS:
+                raise ValueError(f"Unknown kind of rule: {rule.kind}")
+        self.rules = rules
+        self.compiled = {id(r): re.compile(r.pattern) for r in rules}
+        self.matchers = {
+            (is_dir, hidden): self.combine([r for r in rules if r.kind != "zip_name" and r.applies(is_dir, hidden)])
+            for is_dir in (False, True)
+            for hidden in (False, True)
+        }
+        self.forbidden = any(r.kind == "forbidden" for r in rules)
+
+    @staticmethod
+    def combine(rules: list[Rule]) -> tuple[re.Pattern | None, list[Rule]]:
+        if not rules:
+            return None, []
+        return re.compile("|".join(f"(?:{r.pattern})" for r in rules)), rules
+
+    @classmethod
+    def default(cls, parts: list[str] = None, report=True) -> "RuleSet":
+        """The default checks: ZIP file name, a folder for each of the parts, and the report."""
+        rules = [Rule("zip_name", "ZIP file name", ZIP_NAME)]
+        rules += [Rule("folder", part, folder_pattern(part)) for part in sorted(parts or ())]
+        if report:
+            rules.append(Rule("report", "report", REPORT))
+        return cls(rules)
+
+    @classmethod
+    def load(cls, path: str, parts: list[str] = None, report=True) -> "RuleSet":
+        """Load the rules from a JSON file. `parts` and `report` are used for the checks the file leaves out."""
+        with open(path) as f:
+            config = json.load(f)
+        unknown = set(config) - {"zip_name", "folders", "report", "required", "forbidden"}
+        if unknown:
+            raise ValueError(f"Unknown keys in {path}: {', '.join(sorted(unknown))}")
+
+        rules = []
+        zip_name = config.get("zip_name", ZIP_NAME)
+        if zip_name:
+            rules.append(Rule("zip_name", "ZIP file name", zip_name))
+
+        folders = config.get("folders", sorted(parts or ()))
+        if isinstance(folders, dict):
+            rules += [Rule("folder", name, pattern) for name, pattern in folders.items()]
+        else:
+            rules += [Rule("folder", part, folder_pattern(part)) for part in folders]
+
+        report = config.get("report", REPORT if report else None)
+        if report:
+            rules.append(Rule("report", "report", report))
+
+        for kind in ("required", "forbidden"):
+            rules += [Rule(kind, name, pattern) for name, pattern in config.get(kind, {}).items()]
+        return cls(rules)
+
+    def names(self, kind: str) -> list[str]:
+        return [r.name for r in self.rules if r.kind == kind]
+
+    def named_folders(self) -> bool:
+        """Whether the folder rules are named in the rules file, rather than after the parts of the default checks."""
+        return any(r.pattern != folder_pattern(r.name) for r in self.rules if r.kind == "folder")
+
+    def check(self, zip_name: str, paths: list[str]) -> list[Rule]:
+        """Check the ZIP file name and the sorted paths from `list_archive` in one pass. Returns the failed rules."""
+        name = zip_name.replace("_", "-")
+        found = {id(r) for r in self.rules if r.kind == "zip_name" and self.compiled[id(r)].match(name)}
+
+        pending = sum(r.kind not in ("zip_name", "forbidden") for r in self.rules)
+        for path in paths:
+            # Without forbidden files, the rest of the paths cannot change the result once every rule is satisfied
+            if not pending and not self.forbidden:
+                break
+            combined, rules = self.matchers[path.endswith("/"), is_hidden(path)]
+            if combined is None or not combined.search(path):
+                continue
+            for r in rules:
+                if id(r) not in found and self.compiled[id(r)].search(path):
+                    found.add(id(r))
+                    pending -= r.kind != "forbidden"
+
+        return [r for r in self.rules if (id(r) in found) == (r.kind == "forbidden")]
@@ -0,0 +1,138 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+import mos_moss
+from canvas_export import attempt_numbers, group_attempts, latest_attempts
+from mos_moss import unzip_canvas_submission
+from zipfile_check import check_zipfile
+
+FIRST = (2024, 3, 1, 10, 0, 0)
+SECOND = (2024, 3, 2, 10, 0, 0)
+
+
+def student_zip(files: dict[str, str]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return buffer.getvalue()
+
+
+def canvas_zip(path, entries: list[tuple[str, tuple, bytes]]) -> str:
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, date_time, data in entries:
+            zf.writestr(zipfile.ZipInfo(name, date_time), data)
+    return str(path)
+
+
+ARCHIVE = student_zip({"Part_A/main.cpp": "int main() {}", "Part_B/bag.h": ""})
+REPORT = b"%PDF-1.4"
+
+
+def test_attempt_numbers():
+    assert attempt_numbers(["Doe-Assignment-04.zip"]) == [0]
+    assert attempt_numbers(["Doe-Assignment-04.zip", "Doe-Assignment-04-2.zip"]) == [0, 2]
+    assert attempt_numbers(["Doe-Assignment-04-1.zip", "Doe-Assignment-04-2.zip"]) == [1, 2]
+    # The report shares the archive's name, but not its type
+    assert attempt_numbers(["Doe-Assignment-04.zip", "Doe-Assignment-04-Report.pdf"]) == [0, 0]
+    assert attempt_numbers(
+        [
+            "Doe-Assignment-04.zip",
+            "Doe-Assignment-04-Report.pdf",
+            "Doe-Assignment-04-1.zip",
+            "Doe-Assignment-04-Report-1.pdf",
+        ]
+    ) == [0, 0, 1, 1]
+    # The report is only in the later attempt, and takes the suffix of the archive uploaded with it
+    filenames = ["Doe-Assignment-04.zip", "Doe-Assignment-04-1.zip", "Doe-Assignment-04-Report-1.pdf"]
+    assert attempt_numbers(filenames) == [0, 1, 1]
+
+
+def test_latest_attempt_keeps_every_file(tmp_path):
+    path = canvas_zip(
+        tmp_path / "submissions.zip",
+        [
+            ("doejohn_1_100_Doe-Assignment-04.zip", FIRST, ARCHIVE),
+            ("doejohn_1_100_Doe-Assignment-04-1.zip", SECOND, ARCHIVE),
+            ("doejohn_1_100_Doe-Assignment-04-Report-1.pdf", SECOND, REPORT),
+            ("roejane_2_200_Roe-Assignment-04.zip", FIRST, ARCHIVE),
+            ("notes.txt", FIRST, b""),
+        ],
+    )
+    with zipfile.ZipFile(path) as zf:
+        infos = zf.infolist()
+        assert [len(attempts) for attempts in group_attempts(infos).values()] == [2, 1]
+        assert [info.filename for info in latest_attempts(infos)] == [
+            "doejohn_1_100_Doe-Assignment-04-1.zip",
+            "doejohn_1_100_Doe-Assignment-04-Report-1.pdf",
+            "roejane_2_200_Roe-Assignment-04.zip",
+            "notes.txt",
+        ]
+
+
+def test_report_uploaded_next_to_archive(tmp_path):
+    path = canvas_zip(
+        tmp_path / "submissions.zip",
+        [
+            ("doejohn_1_100_Doe-Assignment-04.zip", FIRST, ARCHIVE),
+            ("doejohn_1_100_Doe-Assignment-04-Report.pdf", FIRST, REPORT),
+        ],
+    )
+
+    [submission] = check_zipfile(path, parts=["A", "B"])
+    assert submission.compliance.zip_name == "Doe-Assignment-04.zip"
+    assert submission.compliance
+
+    output = tmp_path / "output"
+    extracted, failed = unzip_canvas_submission(path, str(output))
+    assert not failed
+    assert sorted(os.listdir(output / extracted[0])) == ["Doe-Assignment-04-Report.pdf", "Part_A", "Part_B"]
+
+
+def test_interrupted_extraction_resumes(tmp_path, monkeypatch):
+    path = canvas_zip(
+        tmp_path / "submissions.zip",
+        [(f"student{i}_{i}_{i}00_Assignment-04.zip", FIRST, ARCHIVE) for i in range(1, 4)],
+    )
+    output = str(tmp_path / "output")
+    extract = mos_moss._extract_student_zips
+
+    def interrupted(canvas_zip, members, path, policy):
+        if members[0].startswith("student3"):
+            raise KeyboardInterrupt
+        extract(canvas_zip, members, path, policy)
+
+    monkeypatch.setattr(mos_moss, "_extract_student_zips", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        unzip_canvas_submission(path, output)
+    monkeypatch.undo()
+
+    extracted, failed = unzip_canvas_submission(path, output, incremental=True)
+    assert extracted == ["student3_3_300"]
+    assert not failed
+    assert sorted(os.listdir(output)) == ["student1_1_100", "student2_2_200", "student3_3_300"]
+
+
+def test_document_uploaded_next_to_archive(tmp_path):
+    # A .docx is a ZIP file inside, but is a report, not the student's archive
+    report = student_zip({"[Content_Types].xml": "", "word/document.xml": ""})
+    path = canvas_zip(
+        tmp_path / "submissions.zip",
+        [
+            ("doejohn_1_100_Doe-Assignment-04-Report.docx", FIRST, report),
+            ("doejohn_1_100_Doe-Assignment-04.zip", FIRST, ARCHIVE),
+        ],
+    )
+
+    [submission] = check_zipfile(path, parts=["A", "B"], tree=True)
+    assert submission.compliance.zip_name == "Doe-Assignment-04.zip"
+    assert submission.compliance.zip_name_compliant
+    assert "document.xml" not in submission.compliance.folder_structure
+
+    output = tmp_path / "output"
+    extracted, failed = unzip_canvas_submission(path, str(output))
+    assert not failed
+    assert sorted(os.listdir(output / extracted[0])) == ["Doe-Assignment-04-Report.docx", "Part_A", "Part_B"]
@@ -0,0 +1,46 @@
+import os
+
+import winnow
+from corpus import Corpus
+
+STARTER = 'int read(int *values, int n) {\n    for (int i = 0; i < n; i++) scanf("%d", &values[i]);\n    return n;\n}\n'
+SOLUTION = (
+    "int sum(int *values, int n) {\n    int total = 0;\n    while (n--) total += values[n];\n    return total;\n}\n"
+)
+
+
+def fingerprints(name: str, text: str) -> winnow.Fingerprints:
+    fp = winnow.Fingerprints(name)
+    fp.add_text(f"{name}/main.c", text)
+    return fp
+
+
+def test_rerun_does_not_duplicate_or_match_itself(tmp_path):
+    submission = fingerprints("student0", SOLUTION)
+    with Corpus(str(tmp_path)) as corpus:
+        corpus.add([submission], "2024-fall")
+        corpus.add([submission], "2024-fall")
+        assert len(corpus.documents) == 1
+        assert not corpus.lookup(submission, term="2024-fall")
+        assert [m.second for m in corpus.lookup(submission, term="2025-spring")] == ["2024-fall/student0"]
+
+
+def test_changed_submission_replaces_the_stored_one(tmp_path):
+    with Corpus(str(tmp_path)) as corpus:
+        corpus.add([fingerprints("student0", STARTER)], "2024-fall")
+        corpus.add([fingerprints("student0", SOLUTION)], "2024-fall")
+        assert len(corpus.documents) == 2
+        assert not corpus.lookup(fingerprints("other", STARTER))
+        assert corpus.lookup(fingerprints("other", SOLUTION))
+
+    with open(os.path.join(tmp_path, "documents.jsonl")) as f:
+        assert len(f.readlines()) == 2
+
+
+def test_base_is_left_out_of_both_sides(tmp_path):
+    base = fingerprints("base", STARTER)
+    submission = fingerprints("student0", STARTER + SOLUTION)
+    with Corpus(str(tmp_path)) as corpus:
+        corpus.add([submission], "2024-fall", base=base)
+        [match] = corpus.lookup(submission, base)
+        assert match.first_percent == match.second_percent == 100
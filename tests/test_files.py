@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+from files import atomic_write
+
+
+def test_atomic_write(tmp_path):
+    path = str(tmp_path / "journal.json")
+    with atomic_write(path) as f:
+        f.write("first")
+    with pytest.raises(KeyboardInterrupt):
+        with atomic_write(path) as f:
+            f.write("partial")
+            raise KeyboardInterrupt
+
+    # The interrupted write leaves the previous file, and no temporary file behind
+    assert open(path).read() == "first"
+    assert os.listdir(tmp_path) == ["journal.json"]
@@ -0,0 +1,10 @@
+from mos_moss import next_batch
+
+
+def test_next_batch(tmp_path):
+    assert next_batch(str(tmp_path / "missing")) == 1
+    assert next_batch(str(tmp_path)) == 1
+    for name in ("report1.html", "report2.html", "local_report.json", "index.sqlite"):
+        (tmp_path / name).touch()
+    (tmp_path / "report12").mkdir()
+    assert next_batch(str(tmp_path)) == 13
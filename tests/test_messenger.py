@@ -0,0 +1,72 @@
+import pytest
+import requests
+
+import zipfile_check
+from zipfile_check import CanvasMessenger
+
+MESSAGE = {"recipients": [1], "subject": "Assignment 04", "body": "Hello"}
+
+
+def response(status: int, text="", headers=None) -> requests.Response:
+    r = requests.Response()
+    r.status_code = status
+    r._content = text.encode()
+    r.headers.update(headers or {})
+    return r
+
+
+@pytest.fixture
+def messenger(monkeypatch):
+    monkeypatch.setattr(zipfile_check.time, "sleep", lambda seconds: None)
+    return CanvasMessenger(canvas_token="token", attempts=3)
+
+
+def replies(messenger, monkeypatch, *responses) -> list[dict]:
+    calls = []
+    pending = list(responses)
+
+    def post(url, data, timeout):
+        calls.append(data)
+        reply = pending.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    monkeypatch.setattr(messenger.session, "post", post)
+    return calls
+
+
+def test_retries_rate_limits(messenger, monkeypatch):
+    calls = replies(
+        messenger,
+        monkeypatch,
+        response(429, headers={"Retry-After": "0"}),
+        response(403, "403 Forbidden (Rate Limit Exceeded)", {"Retry-After": "0"}),
+        response(201),
+    )
+    messenger.send(MESSAGE)
+    assert len(calls) == 3
+    assert messenger.sent == {(1, "Assignment 04")}
+
+
+def test_retries_connection_errors(messenger, monkeypatch):
+    calls = replies(messenger, monkeypatch, requests.ConnectionError(), response(201))
+    messenger.send(MESSAGE)
+    assert len(calls) == 2
+
+
+def test_server_errors_are_not_retried(messenger, monkeypatch):
+    # Canvas may have created the conversation before failing, so sending again could message the student twice
+    calls = replies(messenger, monkeypatch, response(502), response(201))
+    with pytest.raises(requests.HTTPError):
+        messenger.send(MESSAGE)
+    assert len(calls) == 1
+    assert not messenger.sent
+
+
+def test_dry_run_sends_nothing(monkeypatch, capsys):
+    messenger = CanvasMessenger(canvas_token="token", dry_run=True)
+    calls = replies(messenger, monkeypatch)
+    assert not messenger.send_all([MESSAGE, {**MESSAGE, "recipients": [2]}])
+    assert not calls
+    assert capsys.readouterr().out.count("'subject': 'Assignment 04'") == 2
@@ -0,0 +1,22 @@
+import ast
+import os
+import tomllib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_packaged_modules_only_import_packaged_modules():
+    # Tools like benchmark.py are run from the repository, but anything the entry points import must be installed
+    with open(os.path.join(ROOT, "pyproject.toml"), "rb") as f:
+        packages = {p["include"].removesuffix(".py") for p in tomllib.load(f)["tool"]["poetry"]["packages"]}
+    local = {name.removesuffix(".py") for name in os.listdir(ROOT) if name.endswith(".py")}
+
+    imported = set()
+    for module in packages:
+        with open(os.path.join(ROOT, module + ".py")) as f:
+            for node in ast.walk(ast.parse(f.read())):
+                if isinstance(node, ast.Import):
+                    imported.update(alias.name for alias in node.names)
+                elif isinstance(node, ast.ImportFrom) and not node.level:
+                    imported.add(node.module)
+    assert imported & local <= packages
@@ -0,0 +1,63 @@
+import itertools
+import random
+
+import pytest
+
+import mos_moss
+from mos_moss import plan_batches
+
+
+def pairs_covered(batches: list[list[str]]) -> set[tuple[str, str]]:
+    return {pair for batch in batches for pair in itertools.combinations(sorted(batch), 2)}
+
+
+@pytest.mark.parametrize("n", [2, 3, 5, 10])
+@pytest.mark.parametrize("count", [1, 2, 7, 23])
+def test_every_pair_shares_a_batch(n, count):
+    folders = [f"s{i:02d}" for i in range(count)]
+    batches = plan_batches(folders, n)
+
+    assert all(len(batch) <= n for batch in batches)
+    assert pairs_covered(batches) >= set(itertools.combinations(folders, 2))
+
+
+def test_no_limit_is_one_batch():
+    folders = ["a", "b", "c"]
+    assert plan_batches(folders, 0) == [folders]
+
+
+def test_only_pairs_with_changed_folders():
+    folders = [f"s{i:02d}" for i in range(12)]
+    changed = {"s03", "s07"}
+    batches = plan_batches(folders, 4, changed=changed)
+
+    needed = {p for p in itertools.combinations(folders, 2) if changed & set(p)}
+    assert pairs_covered(batches) >= needed
+    assert plan_batches(folders, 4, changed=set()) == []
+
+
+def test_batches_within_size_limits():
+    rng = random.Random(0)
+    folders = [f"s{i:02d}" for i in range(15)]
+    sizes = {f: (rng.randint(1, 100), rng.randint(1, 5)) for f in folders}
+    batches = plan_batches(folders, 6, sizes=sizes, max_bytes=250, max_files=12)
+
+    for batch in batches:
+        assert mos_moss.within(sum(sizes[f][0] for f in batch), sum(sizes[f][1] for f in batch), 250, 12)
+    fit = {
+        (a, b)
+        for a, b in itertools.combinations(folders, 2)
+        if mos_moss.within(sizes[a][0] + sizes[b][0], sizes[a][1] + sizes[b][1], 250, 12)
+    }
+    assert pairs_covered(batches) >= fit
+
+
+@pytest.mark.parametrize("n", [1, -1])
+def test_batches_of_one_are_rejected(n):
+    with pytest.raises(ValueError):
+        plan_batches(["a", "b", "c"], n)
+
+
+def test_cli_rejects_batches_of_one():
+    with pytest.raises(SystemExit):
+        mos_moss.parse_args(["submissions.zip", "cpp", "-n", "1"])
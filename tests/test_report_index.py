@@ -0,0 +1,25 @@
+import pytest
+
+from report_index import submission
+
+
+@pytest.mark.parametrize(
+    "name, root",
+    [
+        ("zip_output/doejohn_1_100/main.cpp", "zip_output"),
+        ("zip_output/doejohn_1_100/", "zip_output/"),
+        ("./zip_output/doejohn_1_100/main.cpp", "zip_output"),
+        ("./zip_output/doejohn_1_100/main.cpp", "./zip_output"),
+        ("/tmp/x/zip_output/doejohn_1_100/", "/tmp/x/zip_output"),
+        ("/tmp/x/zip_output/doejohn_1_100/Part_A/main.cpp", "/tmp/x/zip_output/"),
+        ("/tmp/x/my_output/doejohn_1_100/main.cpp", "/tmp/x/my output"),
+        ("doejohn_1_100/main.cpp", ""),
+        ("./doejohn_1_100/main.cpp", "."),
+    ],
+)
+def test_submission(name, root):
+    assert submission(name, root) == "doejohn_1_100"
+
+
+def test_submission_outside_root():
+    assert submission("base/main.cpp", "/tmp/x/zip_output") == "base"
@@ -0,0 +1,109 @@
+import json
+
+import pytest
+
+from rules import Rule, RuleSet
+from zipfile_check import Compliance, Submission, apply_rules, compose_message, display_submissions
+
+PATHS = [
+    "Doe-Assignment-04/",
+    "Doe-Assignment-04/.git/",
+    "Doe-Assignment-04/.git/a.out",
+    "Doe-Assignment-04/Doe-Assignment-04-Report.pdf",
+    "Doe-Assignment-04/Part_A/",
+    "Doe-Assignment-04/Part_A/main.cpp",
+    "Doe-Assignment-04/part-b/",
+    "Doe-Assignment-04/part-b/bag.h",
+]
+
+
+def check(rules: RuleSet, paths=PATHS, zip_name="Doe-Assignment-04.zip") -> Compliance:
+    compliance = Compliance(zip_name=zip_name)
+    apply_rules(compliance, rules, paths)
+    return compliance
+
+
+def load(tmp_path, config: dict, **kwargs) -> RuleSet:
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(config))
+    return RuleSet.load(str(path), **kwargs)
+
+
+def test_default_rules():
+    compliance = check(RuleSet.default(["A", "B"]))
+    assert compliance
+    assert (compliance.zip_name_compliant, compliance.report_name_compliant, compliance.folders_compliant) == (
+        True,
+        True,
+        True,
+    )
+    assert compliance.files_compliant is None
+
+    assert not check(RuleSet.default(["A", "C"])).folders_compliant
+    assert not check(RuleSet.default(), zip_name="doe_asmt4.zip").zip_name_compliant
+    assert check(RuleSet.default(), zip_name="Doe_Assignment_04-1.zip").zip_name_compliant
+
+
+def test_report_must_be_a_visible_pdf():
+    paths = ["Doe/.Assignment-04-Report.pdf", "Doe/Assignment-04-Report.docx", "Doe/Assignment-04-Report/"]
+    assert not check(RuleSet.default(), paths).report_name_compliant
+
+
+def test_required_and_forbidden_files(tmp_path):
+    rules = load(tmp_path, {"required": {"a Makefile": "(^|/)Makefile$"}, "forbidden": {"binaries": r"\.out$"}})
+    compliance = check(rules)
+    assert compliance.files_compliant is False
+    assert compliance.missing_files == ["a Makefile"]
+    # Forbidden files are found in hidden folders too
+    assert compliance.forbidden_files == ["binaries"]
+    assert not compliance
+
+
+def test_skipped_checks_do_not_fail(tmp_path):
+    rules = load(tmp_path, {"zip_name": None, "report": None})
+    compliance = check(rules, zip_name="whatever.zip")
+    assert compliance.zip_name_compliant is None
+    assert compliance.report_name_compliant is None
+    assert compliance
+
+    submission = Submission("doe", 1, 2, compliance)
+    assert compose_message("04", [], submission) is None
+
+
+def test_message_lists_each_failed_check(tmp_path):
+    rules = load(tmp_path, {"folders": {"part C": "(?i:part.*c/)"}, "required": {"a Makefile": "Makefile$"}})
+    submission = Submission("doe", 1, 2, check(rules, zip_name="doe.zip"))
+    body = compose_message("04", rules.names("folder"), submission, rules.named_folders())["body"]
+    assert "ZIP file is not named correctly" in body
+    assert "contain a folder for part C." in body
+    assert "missing a Makefile" in body
+    assert "report" not in body.split("reasons:")[1].split("Be sure")[0]
+
+
+def test_skipped_checks_are_blank_in_the_table(tmp_path, capsys):
+    rules = load(tmp_path, {"zip_name": None})
+    display_submissions([Submission("doe", 1, 2, check(rules))], verbose=False)
+    out = capsys.readouterr().out
+    assert "1 compliant, 0 non-compliant" in out
+    assert "✘" not in out
+
+
+def test_unknown_kind_or_key(tmp_path):
+    with pytest.raises(ValueError):
+        RuleSet([Rule("folders", "A", "a")])
+    with pytest.raises(ValueError):
+        load(tmp_path, {"folder": ["A"]})
+
+
+@pytest.mark.parametrize(
+    "config, expected",
+    [
+        ({"folders": ["A", "B"]}, "folders for parts A and B."),
+        ({"folders": {"the tests": "(?i:tests?/)", "the docs": "(?i:docs/)"}}, "folders for the tests and the docs."),
+    ],
+)
+def test_message_names_the_folders(tmp_path, config, expected):
+    rules = load(tmp_path, config)
+    submission = Submission("doe", 1, 2, check(rules, paths=["Doe-Assignment-04/"]))
+    assert rules.named_folders() == isinstance(config["folders"], dict)
+    assert expected in compose_message("04", rules.names("folder"), submission, rules.named_folders())["body"]
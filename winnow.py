@@ -0,0 +1,192 @@
+"""
+Local similarity engine based on winnowing (Schleimer et al., "Winnowing: Local Algorithms for Document Fingerprinting").
+
+Files are tokenized and every k-gram of tokens is hashed. Winnowing keeps the minimum hash of every window of `w`
+consecutive hashes, which guarantees that any match of at least `w + k - 1` tokens is detected. Fingerprints of the
+base files are subtracted, and fingerprints shared by more than `max_matches` submissions are ignored, like MOSS does.
+"""
+
+import re
+import zlib
+from array import array
+from dataclasses import dataclass, field
+from itertools import combinations
+
+K = 10
+W = 5
+
+TOKEN = re.compile(r"\w+|\S")
+MASK = (1 << 64) - 1
+BASE = 1_000_003
+
+
+@dataclass
+class Fingerprints:
+    """Fingerprints of one submission. Row `i` of each array describes one selected k-gram."""
+
+    name: str
+    files: list[str] = field(default_factory=list)
+    hashes: array = field(default_factory=lambda: array("Q"))
+    file_ids: array = field(default_factory=lambda: array("H"))
+    starts: array = field(default_factory=lambda: array("I"))
+    ends: array = field(default_factory=lambda: array("I"))
+
+    def add_file(self, path: str, k=K, w=W, source: str = None) -> None:
+        """Fingerprint the file at `path`, or read it from `source`, such as a normalized copy, if given."""
+        with open(source or path, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        self.add_text(path, text, k=k, w=w)
+
+    def add_text(self, path: str, text: str, k=K, w=W) -> None:
+        file_id = len(self.files)
+        self.files.append(path)
+
+        tokens, lines = tokenize(text)
+        hashes = kgram_hashes(tokens, k)
+        for i in winnow(hashes, w):
+            self.hashes.append(hashes[i])
+            self.file_ids.append(file_id)
+            self.starts.append(lines[i])
+            self.ends.append(lines[i + k - 1])
+
+    def line_ranges(self, selected: set[int]) -> list[tuple[str, int, int]]:
+        """Merge the lines covered by the selected hashes into `(file, first line, last line)` ranges."""
+        rows = sorted(
+            (self.file_ids[i], self.starts[i], self.ends[i])
+            for i in range(len(self.hashes))
+            if self.hashes[i] in selected
+        )
+        ranges = []
+        for file_id, start, end in rows:
+            if ranges and ranges[-1][0] == file_id and start <= ranges[-1][2] + 1:
+                ranges[-1][2] = max(ranges[-1][2], end)
+            else:
+                ranges.append([file_id, start, end])
+        return [(self.files[file_id], start, end) for file_id, start, end in ranges]
+
+
+@dataclass
+class Match:
+    first: str
+    second: str
+    shared: int
+    first_percent: int
+    second_percent: int
+    first_lines: list[tuple[str, int, int]] = field(default_factory=list)
+    second_lines: list[tuple[str, int, int]] = field(default_factory=list)
+
+
+def tokenize(text: str) -> tuple[list[str], list[int]]:
+    """Split source code into tokens, returning the tokens and the line number each token is on."""
+    tokens, lines = [], []
+    for n, line in enumerate(text.splitlines(), start=1):
+        for token in TOKEN.findall(line):
+            tokens.append(token)
+            lines.append(n)
+    return tokens, lines
+
+
+def kgram_hashes(tokens: list[str], k=K) -> array:
+    """Rolling hash of every k-gram of tokens."""
+    hashes = array("Q")
+    if len(tokens) < k:
+        return hashes
+
+    codes = {t: zlib.crc32(t.encode()) for t in set(tokens)}
+    values = [codes[t] for t in tokens]
+    top = pow(BASE, k - 1, 1 << 64)
+
+    h = 0
+    for v in values[:k]:
+        h = (h * BASE + v) & MASK
+    hashes.append(h)
+    for i in range(k, len(values)):
+        h = ((h - values[i - k] * top) * BASE + values[i]) & MASK
+        hashes.append(h)
+    return hashes
+
+
+def winnow(hashes: array, w=W) -> list[int]:
+    """Select the rightmost minimal hash of every window of `w` hashes, returning their positions."""
+    if not hashes:
+        return []
+    w = min(w, len(hashes))
+
+    selected = []
+    min_i = -1
+    for start in range(len(hashes) - w + 1):
+        end = start + w - 1
+        if min_i < start:
+            min_i = start
+            for i in range(start + 1, end + 1):
+                if hashes[i] <= hashes[min_i]:
+                    min_i = i
+            selected.append(min_i)
+        elif hashes[end] <= hashes[min_i]:
+            min_i = end
+            selected.append(min_i)
+    return selected
+
+
+def fingerprint(submissions: dict[str, list[str]], k=K, w=W, sources: dict[str, str] = None) -> list[Fingerprints]:
+    """Fingerprint the files of each submission. `sources` maps files to read from another path instead."""
+    sources = sources or {}
+    result = []
+    for name, files in submissions.items():
+        fp = Fingerprints(name)
+        for path in files:
+            fp.add_file(path, k=k, w=w, source=sources.get(path))
+        result.append(fp)
+    return result
+
+
+def compare(
+    submissions: list[Fingerprints],
+    base: Fingerprints = None,
+    max_matches=10,
+    top=250,
+    focus: set[str] = None,
+) -> list[Match]:
+    """
+    Score every pair of submissions by the fingerprints they share, and return the `top` pairs ranked by the
+    highest percentage of either submission that was matched.
+    If `focus` is given, only pairs with at least one of the named submissions are scored.
+    """
+    ignored = set(base.hashes) if base else set()
+    unique = [set(s.hashes) - ignored for s in submissions]
+
+    # Inverted index from hash to the submissions containing it
+    postings: dict[int, list[int]] = {}
+    for i, hashes in enumerate(unique):
+        for h in hashes:
+            postings.setdefault(h, []).append(i)
+
+    focused = {i for i, s in enumerate(submissions) if s.name in focus} if focus is not None else None
+
+    counts: dict[tuple[int, int], int] = {}
+    for h, docs in postings.items():
+        if len(docs) > max_matches:
+            ignored.add(h)
+            continue
+        if len(docs) < 2:
+            continue
+        for pair in combinations(docs, 2):
+            if focused is None or pair[0] in focused or pair[1] in focused:
+                counts[pair] = counts.get(pair, 0) + 1
+
+    matches = []
+    for (i, j), shared in counts.items():
+        first_percent = shared * 100 // len(unique[i])
+        second_percent = shared * 100 // len(unique[j])
+        matches.append(Match(submissions[i].name, submissions[j].name, shared, first_percent, second_percent))
+    matches.sort(key=lambda m: (max(m.first_percent, m.second_percent), m.shared), reverse=True)
+    matches = matches[:top]
+
+    # Only look up line ranges for the pairs that are reported
+    by_name = {s.name: s for s in submissions}
+    for m in matches:
+        first, second = by_name[m.first], by_name[m.second]
+        selected = set(first.hashes) & set(second.hashes) - ignored
+        m.first_lines = first.line_ranges(selected)
+        m.second_lines = second.line_ranges(selected)
+    return matches
@@ -1,21 +1,52 @@
 import argparse
-import glob
+import contextlib
+import csv
+import json
 import os
-import re
-import shutil
-import tempfile
-import zipfile
-from dataclasses import dataclass
+import sys
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from pprint import pprint
+from typing import TYPE_CHECKING, TextIO
 
-import dotenv
-import requests
-import seedir
+import instrument
+from archive import CanvasZip, StudentArchive
+from canvas_export import CANVAS_NAME, group_attempts
+from files import atomic_write
+from rules import RuleSet
 
-dotenv.load_dotenv()
+# Imported where they are used: requests and dotenv by the messenger, seedir by the directory trees
+if TYPE_CHECKING:
+    import requests
+    import seedir
 
 # For messaging feature, set Canvas token here or in your environment variable.
 CANVAS_TOKEN = "1234"
+CANVAS_URL = "https://sfsu.instructure.com"
+
+# Slow down messaging once fewer than this many units are left in Canvas' rate limit bucket,
+# pausing up to this many seconds between requests as the bucket runs out.
+RATE_LIMIT_LOW = 200
+RATE_LIMIT_PAUSE = 5.0
+
+# Columns of the CSV and JSONL output, one row per submission
+FIELDS = [
+    "student_name",
+    "canvas_id",
+    "sis_id",
+    "zip_name",
+    "compliant",
+    "zip_name_compliant",
+    "report_name_compliant",
+    "folders_compliant",
+    "files_compliant",
+    "missing_files",
+    "forbidden_files",
+    "folder_structure",
+]
 
 
 @dataclass
@@ -23,13 +54,18 @@ class Compliance:
     zip_name_compliant: bool = None
     report_name_compliant: bool = None
     folders_compliant: bool = None
+    files_compliant: bool = None
 
     zip_name: str = None
     report_name: str = None
     folder_structure: str = None
+    missing_files: list[str] = field(default_factory=list)
+    forbidden_files: list[str] = field(default_factory=list)
 
     def __bool__(self):
-        return all((self.folders_compliant, self.report_name_compliant, self.zip_name_compliant))
+        # Flags of checks the rules skip stay `None`, and do not count against the submission
+        flags = (self.zip_name_compliant, self.report_name_compliant, self.folders_compliant, self.files_compliant)
+        return all(flag is not False for flag in flags)
 
 
 @dataclass
@@ -43,108 +79,169 @@ class Submission:
         return hash(self.sis_id)
 
 
-def cleanup_files(path):
-    """Currently just removes __MACOSX folders."""
-    macos_folders = glob.glob(f"{path}/**/__MACOSX", recursive=True)
-    for f in macos_folders:
-        shutil.rmtree(f)
+def list_archive(student_zip: StudentArchive) -> list[str]:
+    """
+    List the contents of the student's archive, without extracting it.
+    Folders end with a slash and include those only implied by file paths. Skips __MACOSX folders.
+    """
+    paths = set()
+    for name in student_zip.namelist():
+        parts = name.rstrip("/").split("/")
+        if "__MACOSX" in parts:
+            continue
+        for i in range(1, len(parts)):
+            paths.add("/".join(parts[:i]) + "/")
+        paths.add(name)
+    return sorted(paths)
+
+
+def fake_tree(name: str, paths: list[str]) -> "seedir.FakeDir":
+    """Build a `seedir` directory tree from the sorted paths returned by `list_archive`."""
+    import seedir
+
+    root = seedir.FakeDir(name)
+    folders = {"": root}
+    for path in paths:
+        parent, _, item = path.rstrip("/").rpartition("/")
+        if path.endswith("/"):
+            folders[path.rstrip("/")] = seedir.FakeDir(item, parent=folders[parent])
+        else:
+            seedir.FakeFile(item, parent=folders[parent])
+    return root
 
 
-def check_folders(parts: list[str], temp_dir: str) -> bool:
+def check_folders(parts: list[str], paths: list[str]) -> bool:
     """
-    Check if the provided directory contains the required folders for the given parts.
+    Check if the provided paths contain the required folders for the given parts.
 
     Per policy, students are required to have folders in the form "Part_X" for their solutions.
     Attempts to find the given folders in such a format, ignoring case and punctuations.
     """
-    folders = glob.glob(f"{temp_dir}/**/*/", recursive=True)
-    for part in sorted(parts):
-        found = False
-        for folder in folders:
-            if re.search(rf"part.*{part}/", folder, re.IGNORECASE):
-                found = True
-                break
-        if not found:
-            return False
-    return True
-
-
-def check_report(temp_dir: str) -> bool:
+    rules = RuleSet.default(parts, report=False)
+    return not any(r.kind == "folder" for r in rules.check("", paths))
+
+
+def check_report(paths: list[str]) -> bool:
     """Checks if the submissions contains a report, and whether it loosely conforms to the naming format."""
-    pdfs = glob.glob(f"{temp_dir}/**/*.pdf", recursive=True)
-    for pdf in pdfs:
-        if re.search(r"assignment.+report", pdf, re.IGNORECASE):
-            return True
-    return False
+    return not any(r.kind == "report" for r in RuleSet.default(report=True).check("", paths))
 
 
-def check_zipfile(canvas_zip, parts: list[str] = None, report=True, debug=True):
-    submissions = []
+def apply_rules(compliance: Compliance, rules: RuleSet, paths: list[str]) -> None:
+    """Set the compliance flags from the rules, in a single pass over the paths. Checks without rules stay `None`."""
+    failed = rules.check(compliance.zip_name, paths)
+    kinds = {r.kind for r in rules.rules}
+    flags = {
+        "zip_name": "zip_name_compliant",
+        "folder": "folders_compliant",
+        "report": "report_name_compliant",
+    }
+    for kind, flag in flags.items():
+        if kind in kinds:
+            setattr(compliance, flag, not any(r.kind == kind for r in failed))
+    compliance.missing_files = [r.name for r in failed if r.kind == "required"]
+    compliance.forbidden_files = [r.name for r in failed if r.kind == "forbidden"]
+    if kinds & {"required", "forbidden"}:
+        compliance.files_compliant = not compliance.missing_files and not compliance.forbidden_files
+
+
+def check_zipfile(
+    canvas_zip,
+    parts: list[str] = None,
+    report=True,
+    debug=True,
+    all_attempts=False,
+    latest_by="time",
+    rules: RuleSet = None,
+    tree=False,
+) -> list["Submission"]:
+    """Check every submission in the Canvas ZIP file. See `iter_submissions` for the parameters."""
+    return list(iter_submissions(canvas_zip, parts, report, all_attempts, latest_by, rules, tree))
+
+
+def iter_submissions(
+    canvas_zip,
+    parts: list[str] = None,
+    report=True,
+    all_attempts=False,
+    latest_by="time",
+    rules: RuleSet = None,
+    tree=False,
+) -> Iterator["Submission"]:
+    """
+    Check the naming and structure of the submissions in the Canvas ZIP file, yielding each one as soon as it is
+    checked.
 
-    with zipfile.ZipFile(canvas_zip, "r") as zf:
-        files = sorted(zf.infolist(), key=lambda x: x.filename)
-        for submission in files:
+    :param rules: Rules to check the submissions against. Defaults to the ZIP name check, a folder for each of the
+        `parts`, and the report if `report` is set.
+    :param tree: Whether to render the directory tree of each submission, which is otherwise left as `None`.
+    """
+    rules = rules or RuleSet.default(parts, report)
+
+    with CanvasZip(canvas_zip) as zf:
+        students = group_attempts(zf.infolist(), by=latest_by)
+        attempts = [attempt for groups in students.values() for attempt in (groups if all_attempts else groups[-1:])]
+        for attempt in sorted(attempts, key=lambda x: x[0].filename):
+            # The attempt is checked as a whole. Files uploaded next to the student's archive, like the report,
+            # count as files at the top of the submission.
+            archives = [info for info in attempt if zf.is_archive(info)]
+            loose = [info for info in attempt if info not in archives]
+            # Named after the ZIP file if there is one, whatever order the files are listed in
+            submission = min(attempt, key=lambda x: (not x.filename.lower().endswith(".zip"), x not in archives))
             print(submission.filename)
-            res = re.match(r"([^\W_]+)(?:_\w+)*_(\d+)_(\d+)_(.+)", submission.filename)
+            res = CANVAS_NAME.match(submission.filename)
             original_filename = res[4]
             compliance = Compliance()
-
-            # Check ZIP file name
             compliance.zip_name = original_filename
-            if re.match(r"\w+-Assignment-\w+(-\d)?\.zip", original_filename.replace("_", "-")):
-                compliance.zip_name_compliant = True
-            else:
-                compliance.zip_name_compliant = False
-
-            # Check structure and report name
-            with tempfile.TemporaryDirectory() as temp_dir:
-                with zipfile.ZipFile(zf.open(submission)) as student_zip:
-                    student_zip.extractall(temp_dir)
-                    cleanup_files(temp_dir)
-
-                    # Generate the directory tree for display
-                    dir_tree = seedir.fakedir(temp_dir)
-                    dir_tree.name = original_filename
-                    compliance.folder_structure = dir_tree.seedir(
+
+            # Check structure and report name against the archive listing, nothing is extracted
+            paths = {CANVAS_NAME.match(info.filename)[4] for info in loose}
+            for info in archives:
+                with instrument.span("list_archive", bytes=info.compress_size) as s:
+                    try:
+                        with zf.open_archive(info) as student_zip:
+                            listed = list_archive(student_zip)
+                    except Exception as e:
+                        # An unreadable archive fails the checks instead of stopping the run
+                        print(f"Could not read {info.filename}: {type(e).__name__}: {e}")
+                        listed = []
+                    s["files"] = len(listed)
+                paths.update(listed)
+            paths = sorted(paths)
+
+            if tree:
+                with instrument.span("render_tree"):
+                    compliance.folder_structure = fake_tree(original_filename, paths).seedir(
                         printout=False, exclude_folders=".git", itemlimit=5, depthlimit=3, beyond="content"
                     )
 
-                    if parts:
-                        compliance.folders_compliant = check_folders(parts, temp_dir)
-                    if report:
-                        compliance.report_name_compliant = check_report(temp_dir)
-
-            submission = Submission(
-                student_name=res[1], canvas_id=int(res[2]), sis_id=int(res[3]), compliance=compliance
-            )
-            submissions.append(submission)
+            with instrument.span("check"):
+                apply_rules(compliance, rules, paths)
 
-    return submissions
-    # pprint({k: v for k, v in compliance.items() if not v.report})
+            yield Submission(student_name=res[1], canvas_id=int(res[2]), sis_id=int(res[3]), compliance=compliance)
 
 
-def send_message(assignment_name: str, parts: list[str], submission: Submission, canvas_token=None, debug=False):
-    canvas_token = canvas_token or os.getenv("CANVAS_TOKEN") or CANVAS_TOKEN
+def compose_message(assignment_name: str, parts: list[str], submission: Submission, named=False) -> dict | None:
+    """
+    Compose the Canvas conversation for a non-compliant submission.
+    Returns `None` if the submission is compliant, or if no failed check has a reason to give.
 
-    if not canvas_token:
-        raise ValueError("No Canvas token found")
+    :param parts: Names of the required folders.
+    :param named: Whether the folders are named by the rules, like "the tests", instead of by the part they hold.
+    """
     if submission.compliance:
-        return
-
-    messages = [
-        "You are receiving this message because an automated check has found that your submission may not be "
-        "compliant with the grading policy.",
-        f"Your submission for Assignment {assignment_name} may receive a zero for one or more of the following "
-        "reasons:\n",
-    ]
+        return None
 
+    reasons = []
     if submission.compliance.zip_name_compliant is False:
-        messages.append(
+        reasons.append(
             "  - Your submission ZIP file is not named correctly. It should be in the format: "
             f"FirstLast-Assignment-{assignment_name}.zip"
         )
     if submission.compliance.folders_compliant is False:
-        if len(parts) == 1:
+        if named:
+            s = "a folder for " if len(parts) == 1 else "folders for "
+            s += " and ".join(parts) if len(parts) < 3 else ", ".join(parts[:-1]) + ", and " + parts[-1]
+        elif len(parts) == 1:
             s = f"a folder for part {parts[0]}"
         elif len(parts) == 2:
             s = f"folders for parts {parts[0]} and {parts[1]}"
@@ -152,14 +249,27 @@ def send_message(assignment_name: str, parts: list[str], submission: Submission,
             s = "folders for one more of the following parts: "
             s += ", ".join(parts[:-1])
             s += ", and " + parts[-1]
-        messages.append(f"  - Your submission do not appear to contain {s}.")
+        reasons.append(f"  - Your submission do not appear to contain {s}.")
     if submission.compliance.report_name_compliant is False:
-        messages.append(
+        reasons.append(
             f"  - Your assignment report is either: missing, not named correctly, or was submitted in an incorrect "
             f"file format. Your report should be saved as a PDF and named in the format: "
             f"FirstLast-Assignment-{assignment_name}-Report.pdf"
         )
+    if submission.compliance.missing_files:
+        reasons.append(f"  - Your submission is missing {', '.join(submission.compliance.missing_files)}.")
+    if submission.compliance.forbidden_files:
+        reasons.append(f"  - Your submission should not contain {', '.join(submission.compliance.forbidden_files)}.")
+    if not reasons:
+        return None
 
+    messages = [
+        "You are receiving this message because an automated check has found that your submission may not be "
+        "compliant with the grading policy.",
+        f"Your submission for Assignment {assignment_name} may receive a zero for one or more of the following "
+        "reasons:\n",
+        *reasons,
+    ]
     messages.append(
         "\nBe sure to update your submission before the deadline to avoid penalties. Failure to do so may "
         "result in a zero for some or all parts of the assignment."
@@ -167,25 +277,141 @@ def send_message(assignment_name: str, parts: list[str], submission: Submission,
     messages.append("This is an automated check. If you believe this message was sent in error, please let us know.")
     body = "\n".join(messages)
 
-    data = {
+    return {
         "recipients": [submission.canvas_id],
         "body": body,
         "subject": f"Courtesy Notice: Assignment {assignment_name} format",
         "force_new": True,
         "group_conversation": False,
     }
+
+
+def load_env() -> None:
+    """Load the Canvas token and ID from a `.env` file, if there is one."""
+    import dotenv
+
+    dotenv.load_dotenv()
+
+
+class CanvasMessenger:
+    """
+    Sends Canvas conversations over a shared, pooled session with a bounded number of concurrent requests.
+
+    Requests slow down as Canvas' `X-Rate-Limit-Remaining` runs low, and are retried with backoff when rate limited
+    or when the connection fails. Other errors are not retried, as Canvas may have delivered the message anyway, and
+    each conversation is created anew. If `sent_log` is given, messages already delivered are recorded in it, so
+    running again with the same log never messages a student twice.
+    Set `dry_run` to print messages instead of sending them, or point `url` to a stand-in server to test locally.
+    """
+
+    def __init__(self, canvas_token=None, url=CANVAS_URL, workers=4, dry_run=False, sent_log=None, attempts=5):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        load_env()
+        canvas_token = canvas_token or os.getenv("CANVAS_TOKEN") or CANVAS_TOKEN
+        if not canvas_token and not dry_run:
+            raise ValueError("No Canvas token found")
+
+        self.url = url.rstrip("/") + "/api/v1/conversations"
+        self.workers = workers
+        self.dry_run = dry_run
+        self.attempts = attempts
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {canvas_token}"
+        self.session.mount(self.url, HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+
+        self.lock = threading.Lock()
+        self.resume_at = 0.0
+
+        self.sent_log = sent_log
+        self.sent = set()
+        if sent_log and os.path.exists(sent_log):
+            with open(sent_log) as f:
+                self.sent = {tuple(item) for item in json.load(f)}
+
+    def throttle(self, response: "requests.Response" = None, delay=0.0) -> None:
+        """Wait until Canvas is ready for another request, slowing down as the rate limit runs low."""
+        with self.lock:
+            if response is not None:
+                remaining = float(response.headers.get("X-Rate-Limit-Remaining", RATE_LIMIT_LOW))
+                if remaining < RATE_LIMIT_LOW:
+                    delay = max(delay, RATE_LIMIT_PAUSE * (1 - remaining / RATE_LIMIT_LOW))
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+            wait = self.resume_at - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def send(self, data: dict) -> None:
+        import requests
+
+        key = (data["recipients"][0], data["subject"])
+        if key in self.sent:
+            print(f"Already messaged {key[0]}, skipping")
+            return
+        if self.dry_run:
+            # Printed whole, so the messages of concurrent workers don't interleave
+            with self.lock:
+                pprint(data)
+            return
+
+        for attempt in range(1, self.attempts + 1):
+            self.throttle()
+            try:
+                with instrument.span("canvas_call", attempt=attempt) as s:
+                    response = self.session.post(self.url, data=data, timeout=30)
+                    s["status"] = str(response.status_code)
+            except requests.ConnectionError:
+                # The request never reached Canvas, so it's safe to try again
+                if attempt == self.attempts:
+                    raise
+                self.throttle(delay=2**attempt)
+                continue
+
+            rate_limited = response.status_code == 429 or (
+                response.status_code == 403 and "Rate Limit Exceeded" in response.text
+            )
+            if rate_limited and attempt < self.attempts:
+                self.throttle(response, delay=float(response.headers.get("Retry-After", 2**attempt)))
+                continue
+
+            response.raise_for_status()
+            self.throttle(response)
+            break
+
+        with self.lock:
+            self.sent.add(key)
+            if self.sent_log:
+                with atomic_write(self.sent_log) as f:
+                    json.dump(sorted(self.sent), f)
+
+    def send_all(self, messages: list[dict]) -> dict[int, str]:
+        """Send the messages concurrently. Returns a mapping of recipients that could not be messaged to the error."""
+        failures = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.send, data): data["recipients"][0] for data in messages}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failures[futures[future]] = f"{type(e).__name__}: {e}"
+        return failures
+
+
+def send_message(
+    assignment_name: str, parts: list[str], submission: Submission, canvas_token=None, debug=False, named=False
+):
+    data = compose_message(assignment_name, parts, submission, named)
+    if not data:
+        return
     pprint(data)
 
     if debug:
+        load_env()
         data["recipients"] = [int(os.getenv("MY_CANVAS_ID"))]
 
-    with requests.post(
-        url="https://sfsu.instructure.com/api/v1/conversations",
-        headers={"Authorization": f"Bearer {canvas_token}"},
-        data=data,
-    ) as req:
-        pprint(req.headers)
-        pprint(req.json())
+    CanvasMessenger(canvas_token, workers=1).send(data)
 
 
 def display_submissions(submissions: list[Submission], verbose: bool) -> None:
@@ -197,8 +423,13 @@ def display_submissions(submissions: list[Submission], verbose: bool) -> None:
     tick = "\033[42m ✔ \033[0m"  # Green background check mark
     cross = "\033[41m ✘ \033[0m"  # Red background cross mark
 
-    # Table headers
-    headers = ["Name", "Canvas ID", "Filename", "Z", "R", "F"]
+    def mark(flag: bool | None) -> str:
+        """Check or cross mark, or blank for a check the rules skip."""
+        return "   " if flag is None else tick if flag else cross
+
+    # Table headers, with a column for required and forbidden files when the rules have any
+    files = any(s.compliance.files_compliant is not None for s in submissions)
+    headers = ["Name", "Canvas ID", "Filename", "Z", "R", "F"] + (["X"] if files else [])
     rows = []
 
     # Prepare rows for printing
@@ -207,15 +438,17 @@ def display_submissions(submissions: list[Submission], verbose: bool) -> None:
             submission.student_name,
             submission.canvas_id,
             submission.compliance.zip_name,
-            tick if submission.compliance.zip_name_compliant else cross,
-            tick if submission.compliance.report_name_compliant else cross,
-            tick if submission.compliance.folders_compliant else cross,
+            mark(submission.compliance.zip_name_compliant),
+            mark(submission.compliance.report_name_compliant),
+            mark(submission.compliance.folders_compliant),
         ]
+        if files:
+            row.append(mark(submission.compliance.files_compliant))
         rows.append(row)
 
     # Find maximum column widths for pretty printing
     col_widths = [max(len(str(cell)) for cell in col) for col in zip(*[headers] + rows)]
-    col_widths[-3:] = 3, 3, 3  # fixed size for last three columns to ignore ANSI codes
+    col_widths[3:] = [3] * (len(headers) - 3)  # fixed size for the mark columns to ignore ANSI codes
 
     # Print summary
     print(f"{len(submissions)} submissions: {len(good)} compliant, {len(bad)} non-compliant.")
@@ -223,6 +456,8 @@ def display_submissions(submissions: list[Submission], verbose: bool) -> None:
     print("Z = ZIP file name compliance")
     print("R = Report name compliance")
     print("F = Required folder(s) compliance")
+    if files:
+        print("X = Required and forbidden files compliance")
     print()
 
     # Print headers
@@ -249,6 +484,46 @@ def display_submissions(submissions: list[Submission], verbose: bool) -> None:
             print(line)
 
 
+def record(submission: Submission) -> dict:
+    """Flatten the submission into a row of `FIELDS`."""
+    c = submission.compliance
+    return {
+        "student_name": submission.student_name,
+        "canvas_id": submission.canvas_id,
+        "sis_id": submission.sis_id,
+        "zip_name": c.zip_name,
+        "compliant": bool(c),
+        "zip_name_compliant": c.zip_name_compliant,
+        "report_name_compliant": c.report_name_compliant,
+        "folders_compliant": c.folders_compliant,
+        "files_compliant": c.files_compliant,
+        "missing_files": c.missing_files,
+        "forbidden_files": c.forbidden_files,
+        "folder_structure": c.folder_structure,
+    }
+
+
+def stream_submissions(submissions: Iterable[Submission], fmt: str, out: TextIO) -> Iterator[Submission]:
+    """
+    Write each submission to `out` as a line of JSON or a CSV row as soon as it arrives, then pass it on.
+    Nothing is kept, so memory stays the same however many submissions there are.
+    """
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=FIELDS)
+        writer.writeheader()
+    for submission in submissions:
+        row = record(submission)
+        if writer:
+            row["missing_files"] = "; ".join(row["missing_files"])
+            row["forbidden_files"] = "; ".join(row["forbidden_files"])
+            writer.writerow(row)
+        else:
+            out.write(json.dumps(row) + "\n")
+        out.flush()
+        yield submission
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Utility for checking student's submission format.")
 
@@ -256,6 +531,23 @@ def parse_args():
     parser.add_argument("-a", "--asmt", help="The assignment name.", required=True)
     parser.add_argument("-r", "--report", help="Whether a report is required.", action="store_true", default=True)
     parser.add_argument("-p", "--parts", help="Required folders to be present.", nargs="+")
+    parser.add_argument(
+        "--rules",
+        metavar="path",
+        help="JSON file of the course's rules for folders, report and ZIP file names, and required or forbidden files. "
+        "Checks it leaves out use the defaults.",
+    )
+    parser.add_argument(
+        "--all-attempts",
+        help="Check every attempt of resubmitted assignments, instead of only the latest one.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--latest-by",
+        help="Find the latest attempt by the time in the Canvas ZIP file, or by the '-i' suffix of resubmissions.",
+        choices=["time", "suffix"],
+        default="time",
+    )
     parser.add_argument(
         "-m",
         "--send_message",
@@ -263,10 +555,38 @@ def parse_args():
         action="store_true",
         default=False,
     )
+    parser.add_argument("--dry-run", help="Print messages instead of sending them.", action="store_true")
+    parser.add_argument("--canvas-url", help="Base URL of the Canvas instance.", default=CANVAS_URL)
+    parser.add_argument(
+        "--workers",
+        help="Maximum number of messages to send at once.",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--sent-log",
+        metavar="path",
+        help="""
+        Record the students messaged in this file, and skip those it already lists. Use a file per export, to safely
+        rerun a run that was interrupted. By default nothing is recorded, and every non-compliant student is messaged.
+        """,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Save the time spent in each stage as a Chrome trace (JSON), with a summary of each stage.",
+    )
+    parser.add_argument("--cprofile", help="With --profile, also save a cProfile capture of the run.")
+    parser.add_argument(
+        "--format",
+        help="Print a table once every submission is checked, or stream each submission as a line of JSON or a CSV "
+        "row as soon as it is checked. Everything else is printed to stderr when streaming.",
+        choices=["table", "jsonl", "csv"],
+        default="table",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
-        help="Verbose mode. Prints out directory for each submission.",
+        help="Verbose mode. Prints out directory for each submission, or includes it in the streamed output.",
         action="store_true",
         default=False,
     )
@@ -276,12 +596,61 @@ def parse_args():
 
 def main():
     opt = parse_args()
-    pprint(opt)
-
-    submissions = check_zipfile(canvas_zip=opt.zip_file, parts=opt.parts, report=opt.report)
+    out = sys.stdout
+
+    # Streamed output has stdout to itself, so it can be piped into other tools
+    with contextlib.redirect_stdout(sys.stdout if opt.format == "table" else sys.stderr):
+        pprint(opt)
+
+        if opt.profile:
+            instrument.enable(cprofile=bool(opt.cprofile))
+        try:
+            run(opt, out)
+        finally:
+            if opt.profile:
+                instrument.dump(opt.profile, opt.cprofile)
+                print(f"Saved profile to {opt.profile}")
+
+
+def run(opt: argparse.Namespace, out: TextIO = None):
+    """Run the checks with the parsed CLI options. Streamed output is written to `out`, stdout by default."""
+    rules = RuleSet.load(opt.rules, opt.parts, opt.report) if opt.rules else RuleSet.default(opt.parts, opt.report)
+    submissions = iter_submissions(
+        canvas_zip=opt.zip_file,
+        all_attempts=opt.all_attempts,
+        latest_by=opt.latest_by,
+        rules=rules,
+        tree=opt.verbose,
+    )
 
-    display_submissions(submissions, verbose=opt.verbose)
+    parts = rules.names("folder")
+    named = rules.named_folders()
+    messages = []
+    if opt.format == "table":
+        submissions = list(submissions)
+        display_submissions(submissions, verbose=opt.verbose)
+        if opt.send_message:
+            messages = [m for s in submissions if (m := compose_message(opt.asmt, parts, s, named))]
+    else:
+        total = compliant = 0
+        for s in stream_submissions(submissions, opt.format, out or sys.stdout):
+            total += 1
+            compliant += bool(s.compliance)
+            # Only the messages are kept, for the non-compliant submissions
+            if opt.send_message and (m := compose_message(opt.asmt, parts, s, named)):
+                messages.append(m)
+        print(f"{total} submissions: {compliant} compliant, {total - compliant} non-compliant.")
 
     if opt.send_message:
-        for submission in submissions:
-            send_message(assignment_name=opt.asmt, parts=opt.parts, submission=submission)
+        messenger = CanvasMessenger(url=opt.canvas_url, workers=opt.workers, dry_run=opt.dry_run, sent_log=opt.sent_log)
+        failures = messenger.send_all(messages)
+        if opt.dry_run:
+            print(f"Dry run: printed {len(messages) - len(failures)} of {len(messages)} messages, none were sent.")
+        else:
+            print(f"Messaged {len(messages) - len(failures)} of {len(messages)} students.")
+        for recipient, error in failures.items():
+            print(f"Could not message {recipient}: {error}")
+
+
+if __name__ == "__main__":
+    main()